@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Minimal client for the Ambari REST API, used to run commands on other hosts.
+"""
+import base64
+import json
+import logging
+import sys
+import time
+from urllib2 import HTTPError, Request, URLError, urlopen
+
+from trino_client import backoff_delays
+
+URL_TIMEOUT = 30
+REQUEST_TIMEOUT = 1800
+REQUEST_DONE_STATES = ('COMPLETED', 'FAILED', 'ABORTED', 'TIMEDOUT')
+
+logging.basicConfig(stream=sys.stdout)
+_LOGGER = logging.getLogger(__name__)
+
+
+class AmbariClient:
+    def __init__(self, server_url, cluster_name, user, password):
+        self.server_url = server_url.rstrip('/')
+        self.cluster_name = cluster_name
+        self.user = user
+        self.password = password
+
+    def request(self, method, path, body=None):
+        """
+        Sends a request to the Ambari server.
+
+        Returns:
+            The decoded JSON answer, or None when the answer is empty
+
+        Raises:
+            RuntimeError if the request fails
+        """
+        request = Request(self.server_url + path,
+                          json.dumps(body) if body is not None else None)
+        request.get_method = lambda: method
+        request.add_header('Authorization', 'Basic ' + base64.b64encode(
+            '{0}:{1}'.format(self.user, self.password)))
+        request.add_header('X-Requested-By', 'ambari')
+        try:
+            response = urlopen(request, timeout=URL_TIMEOUT)
+            answer = response.read()
+            response.close()
+        except HTTPError as e:
+            raise RuntimeError('Ambari request {0} {1} failed: {2} {3}'.format(
+                method, path, e.code, e.read()))
+        except URLError as e:
+            raise RuntimeError('Ambari request {0} {1} failed: {2}'.format(
+                method, path, e.reason))
+        return json.loads(answer) if answer.strip() else None
+
+    def restart_components(self, service, component, hosts, context):
+        """
+        Restart a component on the given hosts and wait for the restart to
+        finish.
+
+        Raises:
+            RuntimeError if the restart does not complete successfully
+        """
+        body = {
+            'RequestInfo': {
+                'command': 'RESTART',
+                'context': context,
+                'operation_level': {
+                    'level': 'HOST_COMPONENT',
+                    'cluster_name': self.cluster_name,
+                    'service_name': service,
+                },
+            },
+            'Requests/resource_filters': [{
+                'service_name': service,
+                'component_name': component,
+                'hosts': ','.join(hosts),
+            }],
+        }
+        answer = self.request('POST', '/api/v1/clusters/{0}/requests'.format(self.cluster_name), body)
+        self.wait_for_request(answer['Requests']['id'])
+
+    def wait_for_request(self, request_id, timeout=REQUEST_TIMEOUT):
+        deadline = time.time() + timeout
+        delays = backoff_delays()
+        path = '/api/v1/clusters/{0}/requests/{1}'.format(self.cluster_name, request_id)
+        while time.time() < deadline:
+            status = self.request('GET', path)['Requests']['request_status']
+            if status == 'COMPLETED':
+                return
+            if status in REQUEST_DONE_STATES:
+                raise RuntimeError('Ambari request {0} ended with status {1}'.format(
+                    request_id, status))
+            _LOGGER.debug('Ambari request {0} is {1}'.format(request_id, status))
+            time.sleep(next(delays))
+        raise RuntimeError('Ambari request {0} did not finish within {1} seconds'.format(
+            request_id, timeout))
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+TPC-H / TPC-DS benchmark runner built on TrinoClient.
+"""
+import json
+import logging
+import math
+import os
+import socket
+import sys
+import threading
+import time
+from httplib import HTTPException
+
+from trino_client import SHOW_CATALOGS
+
+logging.basicConfig(stream=sys.stdout)
+_LOGGER = logging.getLogger(__name__)
+
+# Queries use the column names of the Trino tpch and tpcds connectors
+TPCH_QUERIES = [
+    ('q01', "select returnflag, linestatus, sum(quantity) as sum_qty, "
+            "sum(extendedprice) as sum_base_price, "
+            "sum(extendedprice * (1 - discount)) as sum_disc_price, "
+            "sum(extendedprice * (1 - discount) * (1 + tax)) as sum_charge, "
+            "avg(quantity) as avg_qty, avg(extendedprice) as avg_price, "
+            "avg(discount) as avg_disc, count(*) as count_order "
+            "from lineitem where shipdate <= date '1998-12-01' - interval '90' day "
+            "group by returnflag, linestatus order by returnflag, linestatus"),
+    ('q03', "select l.orderkey, sum(l.extendedprice * (1 - l.discount)) as revenue, "
+            "o.orderdate, o.shippriority "
+            "from customer c, orders o, lineitem l "
+            "where c.mktsegment = 'BUILDING' and c.custkey = o.custkey "
+            "and l.orderkey = o.orderkey and o.orderdate < date '1995-03-15' "
+            "and l.shipdate > date '1995-03-15' "
+            "group by l.orderkey, o.orderdate, o.shippriority "
+            "order by revenue desc, o.orderdate limit 10"),
+    ('q05', "select n.name, sum(l.extendedprice * (1 - l.discount)) as revenue "
+            "from customer c, orders o, lineitem l, supplier s, nation n, region r "
+            "where c.custkey = o.custkey and l.orderkey = o.orderkey "
+            "and l.suppkey = s.suppkey and c.nationkey = s.nationkey "
+            "and s.nationkey = n.nationkey and n.regionkey = r.regionkey "
+            "and r.name = 'ASIA' and o.orderdate >= date '1994-01-01' "
+            "and o.orderdate < date '1994-01-01' + interval '1' year "
+            "group by n.name order by revenue desc"),
+    ('q06', "select sum(extendedprice * discount) as revenue from lineitem "
+            "where shipdate >= date '1994-01-01' "
+            "and shipdate < date '1994-01-01' + interval '1' year "
+            "and discount between 0.06 - 0.01 and 0.06 + 0.01 and quantity < 24"),
+    ('q10', "select c.custkey, c.name, sum(l.extendedprice * (1 - l.discount)) as revenue, "
+            "c.acctbal, n.name, c.address, c.phone, c.comment "
+            "from customer c, orders o, lineitem l, nation n "
+            "where c.custkey = o.custkey and l.orderkey = o.orderkey "
+            "and o.orderdate >= date '1993-10-01' "
+            "and o.orderdate < date '1993-10-01' + interval '3' month "
+            "and l.returnflag = 'R' and c.nationkey = n.nationkey "
+            "group by c.custkey, c.name, c.acctbal, c.phone, n.name, c.address, c.comment "
+            "order by revenue desc limit 20"),
+    ('q12', "select l.shipmode, "
+            "sum(case when o.orderpriority = '1-URGENT' or o.orderpriority = '2-HIGH' "
+            "then 1 else 0 end) as high_line_count, "
+            "sum(case when o.orderpriority <> '1-URGENT' and o.orderpriority <> '2-HIGH' "
+            "then 1 else 0 end) as low_line_count "
+            "from orders o, lineitem l "
+            "where o.orderkey = l.orderkey and l.shipmode in ('MAIL', 'SHIP') "
+            "and l.commitdate < l.receiptdate and l.shipdate < l.commitdate "
+            "and l.receiptdate >= date '1994-01-01' "
+            "and l.receiptdate < date '1994-01-01' + interval '1' year "
+            "group by l.shipmode order by l.shipmode"),
+    ('q14', "select 100.00 * sum(case when p.type like 'PROMO%' "
+            "then l.extendedprice * (1 - l.discount) else 0 end) "
+            "/ sum(l.extendedprice * (1 - l.discount)) as promo_revenue "
+            "from lineitem l, part p "
+            "where l.partkey = p.partkey and l.shipdate >= date '1995-09-01' "
+            "and l.shipdate < date '1995-09-01' + interval '1' month"),
+]
+
+TPCDS_QUERIES = [
+    ('q03', "select dt.d_year, item.i_brand_id brand_id, item.i_brand brand, "
+            "sum(ss_ext_sales_price) sum_agg "
+            "from date_dim dt, store_sales, item "
+            "where dt.d_date_sk = store_sales.ss_sold_date_sk "
+            "and store_sales.ss_item_sk = item.i_item_sk "
+            "and item.i_manufact_id = 128 and dt.d_moy = 11 "
+            "group by dt.d_year, item.i_brand, item.i_brand_id "
+            "order by dt.d_year, sum_agg desc, brand_id limit 100"),
+    ('q42', "select dt.d_year, item.i_category_id, item.i_category, "
+            "sum(ss_ext_sales_price) "
+            "from date_dim dt, store_sales, item "
+            "where dt.d_date_sk = store_sales.ss_sold_date_sk "
+            "and store_sales.ss_item_sk = item.i_item_sk "
+            "and item.i_manager_id = 1 and dt.d_moy = 11 and dt.d_year = 2000 "
+            "group by dt.d_year, item.i_category_id, item.i_category "
+            "order by sum(ss_ext_sales_price) desc, dt.d_year, item.i_category_id, "
+            "item.i_category limit 100"),
+    ('q55', "select i_brand_id brand_id, i_brand brand, sum(ss_ext_sales_price) ext_price "
+            "from date_dim, store_sales, item "
+            "where d_date_sk = ss_sold_date_sk and ss_item_sk = i_item_sk "
+            "and i_manager_id = 28 and d_moy = 11 and d_year = 1999 "
+            "group by i_brand, i_brand_id order by ext_price desc, i_brand_id limit 100"),
+    ('q96', "select count(*) "
+            "from store_sales, household_demographics, time_dim, store "
+            "where ss_sold_time_sk = time_dim.t_time_sk "
+            "and ss_hdemo_sk = household_demographics.hd_demo_sk "
+            "and ss_store_sk = s_store_sk and time_dim.t_hour = 20 "
+            "and time_dim.t_minute >= 30 and household_demographics.hd_dep_count = 7 "
+            "and store.s_store_name = 'ese' order by count(*) limit 100"),
+]
+
+SUITES = {'tpch': TPCH_QUERIES, 'tpcds': TPCDS_QUERIES}
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of values, None when values is empty.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, int(math.ceil(pct / 100.0 * len(ordered))) - 1)]
+
+
+class BenchmarkRunner:
+    """
+    Runs query suites against the catalogs of the same name at several scale
+    factors (schemas such as 'tiny' or 'sf1') and concurrency levels.
+
+    client_factory is called once per concurrent session and must return a
+    new TrinoClient, which makes the runner easy to point at a mock server.
+    """
+
+    def __init__(self, client_factory, warmup_runs=1, iterations=1, queries=None):
+        self.client_factory = client_factory
+        self.warmup_runs = warmup_runs
+        self.iterations = iterations
+        # query names to run, all queries of a suite when empty
+        self.queries = queries or []
+
+    def available_suites(self, suites):
+        client = self.client_factory()
+        try:
+            catalogs = set(row[0] for row in client.iter_rows(SHOW_CATALOGS))
+        finally:
+            client.close()
+        return [suite for suite in suites if suite in catalogs and suite in SUITES]
+
+    def suite_queries(self, suite):
+        return [(name, sql) for name, sql in SUITES[suite]
+                if not self.queries or name in self.queries]
+
+    def run_query(self, client, suite, schema, name, sql):
+        """
+        Returns:
+            Measurements of one execution, taken from the final query stats
+        """
+        started = time.time()
+        result = {'query': name}
+        try:
+            rows = 0
+            for _ in client.iter_rows(sql, schema, suite):
+                rows += 1
+        except (RuntimeError, ValueError, HTTPException, socket.error) as e:
+            # one broken execution is a failed iteration, not a failed run
+            result['error'] = '{0}: {1}'.format(type(e).__name__, e)
+            return result
+        stats = client.response_from_server.get('stats', {})
+        result.update({
+            'latency_ms': int((time.time() - started) * 1000),
+            'rows': rows,
+            'processed_rows': stats.get('processedRows', 0),
+            'processed_bytes': stats.get('processedBytes', 0),
+            'cpu_time_ms': stats.get('cpuTimeMillis', 0),
+        })
+        return result
+
+    def run_level(self, suite, schema, concurrency):
+        """
+        Run every query of the suite iterations times, spread over
+        concurrency sessions, after warmup_runs unmeasured runs.
+        """
+        queries = self.suite_queries(suite)
+        client = self.client_factory()
+        try:
+            for _ in range(self.warmup_runs):
+                for name, sql in queries:
+                    self.run_query(client, suite, schema, name, sql)
+        finally:
+            client.close()
+
+        pending = [query for _ in range(self.iterations) for query in queries]
+        pending.reverse()
+        results = []
+        lock = threading.Lock()
+
+        def session():
+            session_client = self.client_factory()
+            try:
+                while True:
+                    with lock:
+                        if not pending:
+                            return
+                        name, sql = pending.pop()
+                    result = self.run_query(session_client, suite, schema, name, sql)
+                    with lock:
+                        results.append(result)
+            finally:
+                session_client.close()
+
+        started = time.time()
+        threads = [threading.Thread(target=session) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_time = time.time() - started
+        return self.summarize(suite, schema, concurrency, results, wall_time)
+
+    def summarize(self, suite, schema, concurrency, results, wall_time):
+        succeeded = [result for result in results if 'error' not in result]
+        latencies = [result['latency_ms'] for result in succeeded]
+        return {
+            'suite': suite,
+            'scale_factor': schema,
+            'concurrency': concurrency,
+            'queries': len(succeeded),
+            'failures': [result for result in results if 'error' in result],
+            'wall_time_ms': int(wall_time * 1000),
+            'latency_p50_ms': percentile(latencies, 50),
+            'latency_p95_ms': percentile(latencies, 95),
+            'latency_p99_ms': percentile(latencies, 99),
+            'throughput_qpm': round(len(succeeded) * 60 / wall_time, 2) if wall_time else None,
+            'processed_rows': sum(result['processed_rows'] for result in succeeded),
+            'processed_bytes': sum(result['processed_bytes'] for result in succeeded),
+            'executions': results,
+        }
+
+    def run(self, suites, scale_factors, concurrency_levels):
+        """
+        Returns:
+            One summary per suite, scale factor and concurrency level
+        """
+        summaries = []
+        for suite in self.available_suites(suites):
+            for schema in scale_factors:
+                for concurrency in concurrency_levels:
+                    _LOGGER.info('Running {0} at {1} with concurrency {2}'.format(
+                        suite, schema, concurrency))
+                    summaries.append(self.run_level(suite, schema, concurrency))
+        return summaries
+
+
+def save_results(summaries, output_dir):
+    """
+    Write the summaries to a timestamped JSON file in output_dir.
+
+    Returns:
+        The path of the file
+    """
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    file_path = os.path.join(output_dir, 'benchmark-{0}.json'.format(
+        time.strftime('%Y%m%d-%H%M%S')))
+    with open(file_path, 'w') as f:
+        json.dump({'started': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': summaries},
+                  f, indent=2, sort_keys=True)
+    return file_path
+
+
+def format_summary(summaries):
+    lines = []
+    for summary in summaries:
+        lines.append('{0} {1} x{2}: {3} queries, {4} failed, p50 {5} ms, p95 {6} ms, '
+                     'p99 {7} ms, {8} queries/min'.format(
+                         summary['suite'], summary['scale_factor'], summary['concurrency'],
+                         summary['queries'], len(summary['failures']),
+                         summary['latency_p50_ms'], summary['latency_p95_ms'],
+                         summary['latency_p99_ms'], summary['throughput_qpm']))
+    return '\n'.join(lines)
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Typed catalog templates for the Hive, Iceberg and JDBC connectors.
+
+A templated catalog is described as
+    {'template': 'hive', 'preset': 'interactive', 'cache': False,
+     'properties': {'hive.metastore.uri': 'thrift://metastore:9083'}}
+The preset supplies tuned caching, split scheduling and dynamic filtering
+settings, 'properties' is added on top and wins over the preset.
+"""
+import re
+
+from units import duration_seconds, data_size_bytes
+
+SPEC_KEYS = ('template', 'preset', 'cache', 'properties')
+
+
+def check_duration(value):
+    return duration_seconds(str(value)) is not None
+
+
+def check_positive_int(value):
+    return re.match(r'^\s*[1-9]\d*\s*$', str(value)) is not None
+
+
+def check_bool(value):
+    return str(value).lower() in ('true', 'false')
+
+
+def check_percentage(value):
+    return check_positive_int(value) and int(value) <= 100
+
+
+def check_data_size(value):
+    return data_size_bytes(str(value)) is not None
+
+
+HIVE_TYPES = {
+    'hive.metastore-cache-ttl': check_duration,
+    'hive.metastore-refresh-interval': check_duration,
+    'hive.metastore-cache-maximum-size': check_positive_int,
+    'hive.metastore-refresh-max-threads': check_positive_int,
+    'hive.file-status-cache-size': check_positive_int,
+    'hive.file-status-cache-expire-time': check_duration,
+    'hive.split-loader-concurrency': check_positive_int,
+    'hive.max-outstanding-splits': check_positive_int,
+    'hive.max-outstanding-splits-size': check_data_size,
+    'hive.max-initial-splits': check_positive_int,
+    'hive.dynamic-filtering.wait-timeout': check_duration,
+    'hive.cache.enabled': check_bool,
+    'hive.cache.ttl': check_duration,
+    'hive.cache.disk-usage-percentage': check_percentage,
+}
+
+# connector.name, required properties, property types and presets
+TEMPLATES = {
+    'hive': {
+        'connector.name': 'hive',
+        'required': ['hive.metastore.uri'],
+        'types': HIVE_TYPES,
+        'presets': {
+            # cache metadata and listings so that repeated queries do not
+            # go back to the metastore and the file system
+            'interactive': {
+                'hive.metastore-cache-ttl': '10m',
+                'hive.metastore-refresh-interval': '1m',
+                'hive.metastore-cache-maximum-size': '100000',
+                'hive.metastore-refresh-max-threads': '20',
+                'hive.file-status-cache-tables': '*',
+                'hive.file-status-cache-size': '1000000',
+                'hive.file-status-cache-expire-time': '10m',
+                'hive.split-loader-concurrency': '8',
+                'hive.max-outstanding-splits': '2000',
+                'hive.dynamic-filtering.wait-timeout': '2s',
+            },
+            # large scans benefit from more split loading and from waiting
+            # longer for selective dynamic filters
+            'batch': {
+                'hive.metastore-cache-ttl': '30m',
+                'hive.metastore-refresh-interval': '5m',
+                'hive.metastore-cache-maximum-size': '100000',
+                'hive.metastore-refresh-max-threads': '10',
+                'hive.file-status-cache-tables': '*',
+                'hive.file-status-cache-size': '1000000',
+                'hive.file-status-cache-expire-time': '30m',
+                'hive.split-loader-concurrency': '16',
+                'hive.max-outstanding-splits': '5000',
+                'hive.dynamic-filtering.wait-timeout': '10s',
+            },
+            'none': {},
+        },
+        'cache': {
+            'hive.cache.enabled': 'true',
+            'hive.cache.ttl': '7d',
+            'hive.cache.disk-usage-percentage': '80',
+        },
+    },
+    'iceberg': {
+        'connector.name': 'iceberg',
+        'required': ['hive.metastore.uri'],
+        'types': {
+            'iceberg.dynamic-filtering.wait-timeout': check_duration,
+            'iceberg.max-partitions-per-writer': check_positive_int,
+        },
+        'presets': {
+            'interactive': {
+                'iceberg.dynamic-filtering.wait-timeout': '2s',
+            },
+            'batch': {
+                'iceberg.dynamic-filtering.wait-timeout': '10s',
+            },
+            'none': {},
+        },
+    },
+}
+
+JDBC_TYPES = {
+    'metadata.cache-ttl': check_duration,
+    'metadata.cache-missing': check_bool,
+    'case-insensitive-name-matching': check_bool,
+    'case-insensitive-name-matching.cache-ttl': check_duration,
+}
+JDBC_PRESETS = {
+    'interactive': {
+        'metadata.cache-ttl': '5m',
+        'metadata.cache-missing': 'true',
+    },
+    'batch': {
+        'metadata.cache-ttl': '15m',
+        'metadata.cache-missing': 'true',
+    },
+    'none': {},
+}
+for jdbc_connector in ('postgresql', 'mysql', 'sqlserver', 'oracle'):
+    TEMPLATES[jdbc_connector] = {
+        'connector.name': jdbc_connector,
+        'required': ['connection-url', 'connection-user', 'connection-password'],
+        'types': JDBC_TYPES,
+        'presets': JDBC_PRESETS,
+    }
+
+
+class InvalidCatalogError(ValueError):
+    def __init__(self, catalog, errors):
+        ValueError.__init__(self, 'Invalid catalog {0}:\n  {1}'.format(
+            catalog, '\n  '.join(errors)))
+        self.errors = errors
+
+
+def validate_catalog(catalog, spec):
+    """
+    Returns:
+        a list of human readable problems, empty if the catalog is valid
+    """
+    if not isinstance(spec, dict):
+        return ['a templated catalog must be a dict']
+    errors = ['unknown key ' + key for key in spec if key not in SPEC_KEYS]
+    template = TEMPLATES.get(spec.get('template'))
+    if template is None:
+        return errors + ['template must be one of ' + ', '.join(sorted(TEMPLATES))]
+    preset = spec.get('preset', 'interactive')
+    if preset not in template['presets']:
+        errors.append('preset must be one of ' + ', '.join(sorted(template['presets'])))
+    if spec.get('cache') and 'cache' not in template:
+        errors.append('the {0} template has no local data cache'.format(spec['template']))
+    properties = spec.get('properties', {})
+    if not isinstance(properties, dict):
+        return errors + ['properties must be a dict']
+
+    for key in template['required']:
+        if not str(properties.get(key, '')).strip():
+            errors.append('{0} is required'.format(key))
+    name = properties.get('connector.name', template['connector.name'])
+    if name != template['connector.name']:
+        errors.append('connector.name {0} does not match the {1} template'.format(
+            name, spec['template']))
+    for key, value in sorted(properties.items()):
+        check = template['types'].get(key)
+        if check is not None and not check(value):
+            errors.append('{0}={1} is not a valid {2}'.format(
+                key, value, check.__name__[len('check_'):].replace('_', ' ')))
+
+    values = dict(template['presets'].get(preset, {}))
+    values.update(properties)
+    ttl = duration_seconds(str(values.get('hive.metastore-cache-ttl', '')))
+    refresh = duration_seconds(str(values.get('hive.metastore-refresh-interval', '')))
+    if ttl is not None and refresh is not None and refresh >= ttl:
+        # entries would expire before they are ever refreshed
+        errors.append('hive.metastore-refresh-interval must be shorter than '
+                      'hive.metastore-cache-ttl')
+    return errors
+
+
+def render_catalog(catalog, spec, cache_dirs=()):
+    """
+    Render a templated catalog, with the local data cache spread over
+    cache_dirs when the spec enables it.
+
+    Returns:
+        the catalog properties file content
+
+    Raises:
+        InvalidCatalogError if the catalog does not match its template
+    """
+    errors = validate_catalog(catalog, spec)
+    if errors:
+        raise InvalidCatalogError(catalog, errors)
+    template = TEMPLATES[spec['template']]
+    values = dict(template['presets'][spec.get('preset', 'interactive')])
+    if spec.get('cache'):
+        values.update(template['cache'])
+        values['hive.cache.location'] = ','.join(cache_dirs)
+    values.update(spec.get('properties', {}))
+    values.pop('connector.name', None)
+    lines = ['connector.name={0}\n'.format(template['connector.name'])]
+    lines.extend('{0}={1}\n'.format(key, value) for key, value in sorted(values.items()))
+    return ''.join(lines)
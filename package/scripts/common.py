@@ -14,10 +14,31 @@
 
 import ConfigParser
 import ast
+import errno
+import hashlib
+import httplib
+import json
+import multiprocessing
 import os
 import os.path as path
+import re
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import threading
+import time
+import urllib2
 import uuid
+import zipfile
+from resource_management.core.exceptions import ExecutionFailed
+from resource_management.core.logger import Logger
 from resource_management.core.resources.system import Execute
+from resource_management.libraries.functions.default import default
+
+from catalog_templates import render_catalog, InvalidCatalogError
+from resource_groups import parse_resource_groups
 
 scriptDir = os.path.dirname(os.path.realpath(__file__))
 config = ConfigParser.ConfigParser()
@@ -25,9 +46,11 @@ config.readfp(open(os.path.join(scriptDir, 'download.ini')))
 
 trinoTarUrl = config.get('download', 'trino_tar_url')
 trinoTarName = trinoTarUrl.split('/')[-1]
+trinoTarSha256 = config.get('download', 'trino_tar_sha256')
 trinoCliUrl = config.get('download', 'trino_cli_url')
 jdk11Url = config.get('download', 'jdk11_url')
 jdk11TarName = jdk11Url.split('/')[-1]
+jdk11Sha256 = config.get('download', 'jdk11_sha256')
 
 packageDir = os.path.dirname(scriptDir)
 serviceDir = os.path.dirname(packageDir)
@@ -41,74 +64,1049 @@ trinoHome = basePath + serviceName
 jdk11Home = basePath + 'jdk11/'
 etcDir = trinoHome + '/etc'
 catalogDir = etcDir + '/catalog'
+resourceGroupsPropertiesPath = etcDir + '/resource-groups.properties'
+resourceGroupsJsonPath = etcDir + '/resource-groups.json'
 launcherPath = trinoHome + '/bin/launcher'
+nodeIdPath = basePath + 'node.id'
+cdsDir = basePath + 'cds/'
+startupLogPath = basePath + 'startup_times.jsonl'
 
 exportJavaHomeAndPath = ' export JAVA_HOME=' + jdk11Home + ' && export PATH=${JAVA_HOME}/bin:$PATH '
 
+# signature of the Trino server in /proc/<pid>/cmdline
+SERVER_MAIN_CLASS = 'io.trino.server.TrinoServer'
+STATUS_RUNNING = 'running'
+STATUS_STOPPED = 'stopped'
+STATUS_TIMEOUT = 1
+SERVER_STATES = {'INACTIVE': 'starting', 'ACTIVE': 'active', 'SHUTTING_DOWN': 'shutting down'}
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT = 60
+DOWNLOAD_RETRIES = 5
+
+# fractions of the JVM heap used when memory settings are auto-tuned
+HEAP_HEADROOM_FRACTION = 0.3
+MAX_TOTAL_MEMORY_PER_NODE_FRACTION = 0.6
+MAX_MEMORY_PER_NODE_FRACTION = 0.4
+
+# per core multipliers: worker threads, task concurrency, exchange client
+# threads, and splits per worker thread
+PERFORMANCE_PROFILES = {
+    'interactive': (2, 1, 2, 2),
+    'batch': (1, 0.5, 1, 8),
+    'mixed': (2, 0.5, 1, 4),
+}
+
+# local disks considered for spilling
+SPILL_FILESYSTEMS = ('xfs', 'ext4', 'ext3', 'btrfs')
+SPILL_EXCLUDED_MOUNTS = ('/', '/boot', '/home', '/opt', '/tmp', '/usr', '/var')
+SPILL_EXCLUDED_MOUNT_PREFIXES = ('/boot/', '/var/lib/docker', '/snap/')
+# local data cache of templated catalogs, below each data mount
+CATALOG_CACHE_DIR_NAME = 'trino/cache'
+CATALOG_CACHE_FALLBACK_DIR = '/var/lib/trino/cache'
+# entries of multi-release jars and descriptors cannot be archived
+CDS_SKIPPED_CLASS = re.compile(r'^META-INF/|(^|/)(module-info|package-info)\.class$')
+# name pattern of the files written by Trino's file spiller
+SPILL_FILE = re.compile(r'^spill.*\.bin$')
+
+def file_digest(file_path, algorithm='sha256'):
+    digest = hashlib.new(algorithm)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_entry_dir(cache_dir, url, sha256):
+    key = hashlib.sha256('{0}\n{1}'.format(url, sha256 or '').encode('utf-8')).hexdigest()
+    return path.join(cache_dir, key)
+
+
+def evict_artifacts(cache_dir, max_size_bytes, keep):
+    """
+    Remove the least recently used cache entries until the cache fits in
+    max_size_bytes. Entries listed in keep are never removed.
+    """
+    entries = []
+    total_size = 0
+    for name in os.listdir(cache_dir):
+        entry = path.join(cache_dir, name)
+        if not path.isdir(entry):
+            continue
+        size = 0
+        last_used = 0
+        try:
+            for file_name in os.listdir(entry):
+                stat = os.stat(path.join(entry, file_name))
+                size += stat.st_size
+                last_used = max(last_used, stat.st_mtime)
+        except OSError as e:
+            # the entry was renamed or removed while it was being measured
+            if e.errno != errno.ENOENT:
+                raise
+            continue
+        entries.append((last_used, size, entry))
+        total_size += size
+
+    for last_used, size, entry in sorted(entries):
+        if total_size <= max_size_bytes:
+            break
+        if entry in keep:
+            continue
+        shutil.rmtree(entry, ignore_errors=True)
+        total_size -= size
+
+
+def cached_artifact_path(url, sha256):
+    from params import artifact_cache_dir
+    entry_dir = cache_entry_dir(artifact_cache_dir, url, sha256)
+    return path.join(entry_dir, url.split('/')[-1])
+
+
+def lookup_artifact(url, sha256=''):
+    """
+    Return the path of the cached copy of url, or None on a cache miss.
+
+    Artifacts are kept in the artifact cache keyed by url and expected
+    sha256. When no sha256 is configured the digest of the first download is
+    recorded and later hits are verified against it.
+    """
+    artifact_path = cached_artifact_path(url, sha256)
+    digest_path = artifact_path + '.sha256'
+    if not path.isfile(artifact_path) or not path.isfile(digest_path):
+        return None
+
+    with open(digest_path) as f:
+        recorded = f.read().strip()
+    if recorded == file_digest(artifact_path) and (not sha256 or recorded == sha256):
+        os.utime(artifact_path, None)
+        return artifact_path
+    shutil.rmtree(path.dirname(artifact_path), ignore_errors=True)
+    return None
+
+
+def store_artifact(url, sha256, digest, published_sha1='', sha1=''):
+    """
+    Move a completely fetched '.part' file into the artifact cache once its
+    digest matches the pinned sha256 or, without one, its sha1 matches the
+    published_sha1.
+    """
+    artifact_path = cached_artifact_path(url, sha256)
+    entry_dir = path.dirname(artifact_path)
+    if sha256 and digest != sha256:
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        raise RuntimeError('Checksum mismatch for {0}: expected {1} but got {2}'.format(
+            url, sha256, digest))
+    if not sha256 and published_sha1 and sha1 != published_sha1:
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        raise RuntimeError('Checksum mismatch for {0}: published sha1 is {1} but got {2}'.format(
+            url, published_sha1, sha1))
+    if not sha256 and not published_sha1:
+        Logger.warning('No sha256 is pinned for {0} in download.ini, trusting the first '
+                       'download with sha256 {1}'.format(url, digest))
+    with open(artifact_path + '.sha256', 'w') as f:
+        f.write(digest)
+    os.rename(artifact_path + '.part', artifact_path)
+    return artifact_path
+
+
+def fetch_published_sha1(url, mirror_path):
+    """
+    Returns:
+        The sha1 published next to url, as Maven Central does for every
+        artifact, read from the mirror directory if it has a copy, or ''
+        when there is none
+    """
+    try:
+        if mirror_path and path.isfile(mirror_path + '.sha1'):
+            with open(mirror_path + '.sha1') as f:
+                text = f.read()
+        else:
+            response = open_download(url + '.sha1', 0)
+            text = response.read()
+            response.close()
+    except (EnvironmentError, urllib2.URLError, httplib.HTTPException, socket.error) as e:
+        Logger.warning('Could not read the published sha1 of {0}: {1}'.format(url, e))
+        return ''
+    # the file holds the digest, optionally followed by the file name
+    fields = text.split()
+    if not fields or not re.match(r'^[0-9a-fA-F]{40}$', fields[0]):
+        Logger.warning('Ignoring the malformed published sha1 of {0}'.format(url))
+        return ''
+    return fields[0].lower()
+
+
+def open_download(url, offset):
+    request = urllib2.Request(url)
+    if offset:
+        request.add_header('Range', 'bytes={0}-'.format(offset))
+    # same as wget --no-check-certificate
+    if hasattr(ssl, '_create_unverified_context'):
+        return urllib2.urlopen(request, timeout=DOWNLOAD_TIMEOUT,
+                               context=ssl._create_unverified_context())
+    return urllib2.urlopen(request, timeout=DOWNLOAD_TIMEOUT)
+
+
+def stream_download(url, sinks):
+    """
+    Download url and pass every chunk to each of the sinks as it arrives.
+
+    Interrupted transfers are resumed with a range request from the last
+    byte received. If the server ignores the range the bytes already
+    received are skipped.
+    """
+    offset = 0
+    attempt = 0
+    while True:
+        try:
+            response = open_download(url, offset)
+            skip = offset if response.getcode() != 206 else 0
+            length = response.info().getheader('Content-Length')
+            expected = int(length) + offset - skip if length else None
+            while True:
+                chunk = response.read(DOWNLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if skip:
+                    dropped = min(skip, len(chunk))
+                    chunk = chunk[dropped:]
+                    skip -= dropped
+                    if not chunk:
+                        continue
+                for sink in sinks:
+                    sink(chunk)
+                offset += len(chunk)
+            response.close()
+            if expected is None or offset >= expected:
+                return offset
+            raise httplib.IncompleteRead('', expected - offset)
+        except (urllib2.URLError, httplib.HTTPException, socket.error) as e:
+            attempt += 1
+            if attempt > DOWNLOAD_RETRIES:
+                raise
+            Logger.warning('Download of {0} interrupted at byte {1} ({2}), resuming'.format(
+                url, offset, e))
+            time.sleep(min(2 ** attempt, 30))
+
+
+def promote_staging_dir(staging_dir, target_dir):
+    """
+    Move every top level entry of staging_dir into target_dir, replacing
+    entries of the same name. Entries only present in target_dir, such as
+    the rendered etc directory, are kept.
+    """
+    if not path.isdir(target_dir):
+        os.makedirs(target_dir)
+    for name in os.listdir(staging_dir):
+        target = path.join(target_dir, name)
+        if path.isdir(target) and not path.islink(target):
+            shutil.rmtree(target)
+        elif path.lexists(target):
+            os.remove(target)
+        os.rename(path.join(staging_dir, name), target)
+
+
+def install_artifact(url, sha256, target_dir, expected_file, sha1_published=False):
+    """
+    Extract the artifact at url into target_dir.
+
+    Without a pinned sha256, an artifact whose sha1 is published next to it
+    (sha1_published) is checked against that before it enters the cache.
+
+    Cached artifacts, or artifacts found in the mirror directory, are
+    extracted from the local copy. Otherwise the download is streamed into
+    tar while being written to the artifact cache and hashed, so no
+    intermediate file in /tmp is needed. Every artifact is extracted into a
+    staging directory whose top level entries replace those of target_dir,
+    a downloaded one only once the digest matches, so no files of a
+    previously installed version are left behind. The extracted tree is
+    verified by checking that expected_file exists.
+    """
+    from params import artifact_mirror_dir
+
+    artifact_path = lookup_artifact(url, sha256)
+    artifact_name = url.split('/')[-1]
+    mirror_path = path.join(artifact_mirror_dir, artifact_name) if artifact_mirror_dir else ''
+    part_path = cached_artifact_path(url, sha256) + '.part'
+    if not path.isdir(path.dirname(part_path)):
+        os.makedirs(path.dirname(part_path))
+
+    published_sha1 = ''
+    if artifact_path is None and not sha256 and sha1_published:
+        published_sha1 = fetch_published_sha1(url, mirror_path)
+
+    if artifact_path is None and mirror_path and path.isfile(mirror_path):
+        shutil.copyfile(mirror_path, part_path)
+        artifact_path = store_artifact(url, sha256, file_digest(part_path), published_sha1,
+                                       file_digest(part_path, 'sha1'))
+
+    staging_dir = target_dir.rstrip('/') + '.staging'
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.makedirs(staging_dir)
+    try:
+        if artifact_path is not None:
+            subprocess.check_call(['tar', '-xf', artifact_path, '-C', staging_dir,
+                                   '--strip-components=1'])
+        else:
+            digest = hashlib.sha256()
+            sha1 = hashlib.sha1()
+            tar = subprocess.Popen(['tar', '-xzf', '-', '-C', staging_dir,
+                                    '--strip-components=1'], stdin=subprocess.PIPE)
+            try:
+                with open(part_path, 'wb') as part:
+                    stream_download(url, [tar.stdin.write, part.write, digest.update,
+                                          sha1.update])
+            finally:
+                tar.stdin.close()
+                returncode = tar.wait()
+            if returncode != 0:
+                raise RuntimeError('Failed to extract {0} into {1}'.format(
+                    artifact_name, staging_dir))
+            # raises on a checksum mismatch, before anything reaches target_dir
+            store_artifact(url, sha256, digest.hexdigest(), published_sha1, sha1.hexdigest())
+        promote_staging_dir(staging_dir, target_dir)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    if not path.exists(path.join(target_dir, expected_file)):
+        raise RuntimeError('{0} is missing after extracting {1}'.format(
+            path.join(target_dir, expected_file), artifact_name))
+
+
+def run_in_parallel(calls):
+    """
+    Run each (function, args) pair in its own thread and re-raise the first
+    failure once all of them have finished.
+    """
+    errors = []
+
+    def run(function, args):
+        try:
+            function(*args)
+        except Exception:
+            errors.append(sys.exc_info())
+
+    threads = [threading.Thread(target=run, args=call) for call in calls]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        # re-raised with the traceback of the thread that failed
+        exc_type, exc_value, exc_traceback = errors[0]
+        raise exc_type, exc_value, exc_traceback
+
+
 def deploying():
-    # download jdk11 and extract jdk11 tarball
-    tmpJdk11Path = '/tmp/' + jdk11TarName
+    # fetch jdk11 and trino at the same time, each streamed into its extractor
     Execute('mkdir -p {0}'.format(jdk11Home))
-    Execute('wget --no-check-certificate {0} -O {1}'.format(jdk11Url, tmpJdk11Path))
-    Execute('tar -xf {0} -C {1} --strip-components=1'.format(tmpJdk11Path, jdk11Home))
-
-    # download and extract trino tarball
     Execute('mkdir -p {0}'.format(catalogDir))
-    tmptrinoTarballPath = '/tmp/' + trinoTarName
-    Execute('wget --no-check-certificate {0} -O {1}'.format(trinoTarUrl, tmptrinoTarballPath))
-    Execute('tar -xf {0} -C {1} --strip-components=1'.format(tmptrinoTarballPath, trinoHome))
+    from params import artifact_cache_dir, artifact_cache_max_size
+    run_in_parallel([
+        (install_artifact, (jdk11Url, jdk11Sha256, jdk11Home, 'bin/java')),
+        (install_artifact, (trinoTarUrl, trinoTarSha256, trinoHome, 'bin/launcher', True))])
+    # once both installs are done, so that no '.part' file is being renamed
+    evict_artifacts(artifact_cache_dir, artifact_cache_max_size * 1024 * 1024,
+                    [cache_entry_dir(artifact_cache_dir, jdk11Url, jdk11Sha256),
+                     cache_entry_dir(artifact_cache_dir, trinoTarUrl, trinoTarSha256)])
+
+
+def cds_version_key():
+    """
+    Returns a key that changes whenever the installed JDK or the Trino
+    server class path changes.
+    """
+    digest = hashlib.sha256()
+    with open(path.join(jdk11Home, 'release'), 'rb') as f:
+        digest.update(f.read())
+    lib_dir = path.join(trinoHome, 'lib')
+    for name in sorted(os.listdir(lib_dir)):
+        stat = os.stat(path.join(lib_dir, name))
+        digest.update('{0} {1} {2}\n'.format(name, stat.st_size, int(stat.st_mtime)).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def cds_archive_path():
+    """
+    Returns the AppCDS archive path of the installed versions, None while
+    Trino or the JDK is not installed.
+    """
+    if not path.isfile(path.join(jdk11Home, 'release')) or \
+            not path.isdir(path.join(trinoHome, 'lib')):
+        return None
+    return path.join(cdsDir, 'trino-{0}.jsa'.format(cds_version_key()))
+
+
+def write_cds_class_list(class_list_path):
+    """
+    Write the JDK default class list followed by every class of the Trino
+    server class path. Plugin classes are left out, JDK 11 cannot archive
+    classes of custom class loaders.
+    """
+    lib_dir = path.join(trinoHome, 'lib')
+    with open(class_list_path, 'w') as out:
+        with open(path.join(jdk11Home, 'lib', 'classlist')) as f:
+            shutil.copyfileobj(f, out)
+        for name in sorted(os.listdir(lib_dir)):
+            if not name.endswith('.jar'):
+                continue
+            with zipfile.ZipFile(path.join(lib_dir, name)) as jar:
+                for entry in jar.namelist():
+                    if entry.endswith('.class') and not CDS_SKIPPED_CLASS.search(entry):
+                        out.write(entry[:-len('.class')] + '\n')
+
+
+def generate_cds_archive(jvm_content):
+    """
+    Dump an AppCDS archive of the Trino server class path for the installed
+    Trino and JDK versions, replacing archives of previous versions. The
+    heap options of jvm_content are used, the archive is ignored by a JVM
+    whose compressed oops setting differs.
+
+    A failed dump leaves a marker holding the heap options next to the
+    archive, and is not retried until the versions or the heap options
+    change.
+
+    Returns:
+        The archive path, or None if it could not be generated
+    """
+    archive = cds_archive_path()
+    if archive is None:
+        return None
+    if path.isfile(archive):
+        return archive
+    heap_options = ' '.join(re.findall(r'^\s*(-Xmx\S+|-XX:[+-]UseG1GC)\s*$', jvm_content, re.M))
+    failed_marker = archive[:-len('.jsa')] + '.failed'
+    if path.isfile(failed_marker):
+        with open(failed_marker) as f:
+            if f.read() == heap_options:
+                Logger.info('Skipping the AppCDS archive, generating it failed before, see ' +
+                            archive[:-len('.jsa')] + '.log')
+                return None
+    if not path.isdir(cdsDir):
+        os.makedirs(cdsDir)
+    for name in os.listdir(cdsDir):
+        os.remove(path.join(cdsDir, name))
 
+    class_list = archive[:-len('.jsa')] + '.classlist'
+    started = time.time()
+    try:
+        write_cds_class_list(class_list)
+        # classes that fail to load are skipped by the dump with a warning
+        Execute(exportJavaHomeAndPath + " && java -Xshare:dump -XX:SharedClassListFile={0} "
+                "-XX:SharedArchiveFile={1} {2} -cp '{3}' > {4}.log 2>&1".format(
+                    class_list, archive, heap_options, path.join(trinoHome, 'lib', '*'),
+                    archive[:-len('.jsa')]))
+    except (ExecutionFailed, EnvironmentError, zipfile.BadZipfile) as e:
+        Logger.warning('Failed to generate the AppCDS archive, starting without it: ' + str(e))
+        if path.isfile(archive):
+            os.remove(archive)
+        with open(failed_marker, 'w') as f:
+            f.write(heap_options)
+        return None
+    Logger.info('Generated AppCDS archive {0} in {1:.1f}s'.format(archive, time.time() - started))
+    return archive
 
-def create_connectors(connectors_to_add):
+
+def apply_cds_archive(jvm_content, archive):
+    """
+    Returns:
+        jvm_content using archive for class data sharing
+    """
+    lines = [line for line in jvm_content.splitlines()
+             if not re.match(r'^\s*(-XX:SharedArchiveFile=|-Xshare:)', line)]
+    lines.append('-XX:SharedArchiveFile=' + archive)
+    # fall back to a normal start if the archive does not match the JVM
+    lines.append('-Xshare:auto')
+    return '\n'.join(lines) + '\n'
+
+
+def record_startup(seconds):
+    """
+    Append the time a start took until the server reported it had started to
+    startupLogPath, noting whether it used an AppCDS archive.
+    """
+    jvm_config = path.join(etcDir, 'jvm.config')
+    with open(jvm_config) as f:
+        cds = '-XX:SharedArchiveFile=' in f.read()
+    with open(startupLogPath, 'a') as f:
+        f.write(json.dumps({'time': int(time.time()), 'seconds': round(seconds, 2),
+                            'cds': cds, 'trino': path.basename(trinoHome.rstrip('/'))}) + '\n')
+
+
+def startup_report():
+    """
+    Returns:
+        A table comparing the recorded start times without and with AppCDS
+    """
+    starts = {False: [], True: []}
+    if path.isfile(startupLogPath):
+        with open(startupLogPath) as f:
+            for line in f:
+                record = json.loads(line)
+                starts[record['cds']].append(record['seconds'])
+    lines = ['{0:<10} {1:>6} {2:>9} {3:>9} {4:>9}'.format('mode', 'starts', 'mean s', 'min s',
+                                                          'max s')]
+    for cds, label in ((False, 'no AppCDS'), (True, 'AppCDS')):
+        seconds = starts[cds]
+        if not seconds:
+            lines.append('{0:<10} {1:>6}'.format(label, 0))
+            continue
+        lines.append('{0:<10} {1:>6} {2:>9.2f} {3:>9.2f} {4:>9.2f}'.format(
+            label, len(seconds), sum(seconds) / len(seconds), min(seconds), max(seconds)))
+    if starts[False] and starts[True]:
+        before = sum(starts[False]) / len(starts[False])
+        after = sum(starts[True]) / len(starts[True])
+        lines.append('AppCDS changed the mean start time by {0:+.1f}%'.format(
+            (after - before) / before * 100))
+    return '\n'.join(lines)
+
+
+def render_connectors(connectors_to_add):
+    """
+    Returns:
+        Catalog file path -> content for every connector in connectors_to_add
+    """
     if not connectors_to_add:
-        return
+        return {}
     connectors_dict = ast.literal_eval(connectors_to_add)
+    rendered = {}
     for connector in connectors_dict:
         connector_file = os.path.join(catalogDir, connector + '.properties')
-        with open(connector_file, 'w') as f:
-            for lineitem in connectors_dict[connector]:
-                f.write('{0}\n'.format(lineitem))
+        rendered[connector_file] = ''.join('{0}\n'.format(lineitem)
+                                           for lineitem in connectors_dict[connector])
+    return rendered
+
 
+def catalog_cache_dirs(catalog):
+    """
+    Returns one local data cache directory per data disk for catalog, on
+    the configured spill_mounts if any.
+    """
+    from params import spill_mounts
+    mounts = spill_mounts or data_mounts()
+    if not mounts:
+        return [path.join(CATALOG_CACHE_FALLBACK_DIR, catalog)]
+    return [path.join(mount, CATALOG_CACHE_DIR_NAME, catalog) for mount in mounts]
 
-def delete_connectors(connectors_to_delete):
+
+def templated_catalogs(templated_connectors_to_add):
+    """
+    Returns:
+        Catalog name -> template spec for every catalog in
+        templated_connectors_to_add
+    """
+    if not templated_connectors_to_add:
+        return {}
+    return ast.literal_eval(templated_connectors_to_add)
+
+
+def render_templated_connectors(templated_connectors_to_add, connectors_to_add):
+    """
+    Returns:
+        Catalog file path -> content for every templated catalog
+
+    Raises:
+        InvalidCatalogError if a catalog does not match its template
+    """
+    plain = ast.literal_eval(connectors_to_add) if connectors_to_add else {}
+    rendered = {}
+    for catalog, spec in sorted(templated_catalogs(templated_connectors_to_add).items()):
+        if catalog in plain:
+            raise InvalidCatalogError(catalog, ['defined in both connectors.to.add and '
+                                                'templated.connectors.to.add'])
+        rendered[os.path.join(catalogDir, catalog + '.properties')] = render_catalog(
+            catalog, spec, catalog_cache_dirs(catalog))
+    return rendered
+
+
+def delete_connectors(connectors_to_delete, keep=()):
+    """
+    Remove the catalog files of connectors_to_delete, except those in keep.
+
+    Returns:
+        The catalog files that were actually removed
+    """
     if not connectors_to_delete:
-        return
+        return []
     connectors_list = ast.literal_eval(connectors_to_delete)
+    removed = []
     for connector in connectors_list:
         connector_file_name = os.path.join(catalogDir, connector + '.properties')
+        if connector_file_name in keep:
+            continue
+        if path.exists(connector_file_name):
+            removed.append(connector_file_name)
         Execute('rm -f {0}'.format(connector_file_name))
+    return removed
 
-def create_configure(coordinator): 
+
+def host_resources():
+    """
+    Returns the physical memory in bytes and the number of cores of this host.
+    """
+    memory = 0
+    with open('/proc/meminfo') as f:
+        for line in f:
+            if line.startswith('MemTotal:'):
+                memory = int(line.split()[1]) * 1024
+                break
+    return memory, multiprocessing.cpu_count()
+
+
+def size_in_gb(value):
+    """
+    Parse a memory setting such as '30GB' or '30' (the Ambari slider value) into whole GB.
+    """
+    return int(str(value).strip().upper().rstrip('B').rstrip('G').strip())
+
+
+def autotune_memory(config_properties, jvm_content, worker_count, heap_fraction):
+    """
+    Size the JVM heap and the Trino memory pools from this host's memory.
+
+    The heap gets heap_fraction of the physical memory and the per node
+    limits are fixed fractions of the heap, which keeps
+    query.max-total-memory-per-node + memory.heap-headroom-per-node below the
+    heap on every host. query.max-memory is the autotuned
+    query.max-memory-per-node times the number of workers.
+
+    Returns:
+        The jvm.config content with the new -Xmx and the config properties
+        with the memory settings replaced, in GB.
+    """
+    memory, _ = host_resources()
+    heap = max(1, int(memory * heap_fraction / 1024 ** 3))
+
+    properties = dict(config_properties)
+    properties['memory.heap-headroom-per-node'] = str(max(1, int(heap * HEAP_HEADROOM_FRACTION)))
+    properties['query.max-total-memory-per-node'] = str(max(1, int(heap * MAX_TOTAL_MEMORY_PER_NODE_FRACTION)))
+    max_memory_per_node = max(1, int(heap * MAX_MEMORY_PER_NODE_FRACTION))
+    properties['query.max-memory-per-node'] = str(max_memory_per_node)
+    properties['query.max-memory'] = str(max_memory_per_node * max(1, worker_count))
+
+    xmx = '-Xmx{0}G'.format(heap)
+    if re.search(r'-Xmx\S+', jvm_content):
+        jvm_content = re.sub(r'-Xmx\S+', xmx, jvm_content)
+    else:
+        jvm_content = xmx + '\n' + jvm_content
+    return jvm_content, properties
+
+
+def numa_node_count():
+    nodes = [name for name in os.listdir('/sys/devices/system/node')
+             if re.match(r'node\d+$', name)] if path.isdir('/sys/devices/system/node') else []
+    return max(1, len(nodes))
+
+
+def power_of_two_floor(value):
+    result = 1
+    while result * 2 <= value:
+        result *= 2
+    return result
+
+
+def apply_performance_profile(config_properties, profile):
+    """
+    Derive the task and exchange concurrency settings from this host's core
+    count and NUMA layout for the given profile. Settings already present in
+    config.properties, for instance added as custom properties in Ambari,
+    take precedence.
+
+    Returns:
+        The config properties with the derived settings added
+    """
+    if profile not in PERFORMANCE_PROFILES:
+        return config_properties
+    threads_per_core, concurrency_per_core, exchange_per_core, splits_per_thread = \
+        PERFORMANCE_PROFILES[profile]
+    _, cores = host_resources()
+    numa_nodes = numa_node_count()
+
+    # spread worker threads evenly over the NUMA nodes
+    worker_threads = max(8, int(cores * threads_per_core))
+    worker_threads += -worker_threads % numa_nodes
+
+    derived = {
+        'task.concurrency': str(min(32, power_of_two_floor(max(1, cores * concurrency_per_core)))),
+        'task.max-worker-threads': str(worker_threads),
+        'exchange.client-threads': str(max(25, int(cores * exchange_per_core))),
+        'node-scheduler.max-splits-per-node': str(worker_threads * splits_per_thread),
+    }
+    properties = dict(config_properties)
+    for key, value in derived.items():
+        if key not in properties:
+            properties[key] = value
+    return properties
+
+
+def data_mounts():
+    """
+    Returns the mount points of the local data disks, one per device,
+    leaving out the operating system file systems.
+    """
+    mounts = []
+    devices = set()
+    with open('/proc/mounts') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 4:
+                continue
+            device, mount_point, fs_type, options = fields[:4]
+            mount_point = mount_point.replace('\\040', ' ')
+            if not device.startswith('/dev/') or device.startswith('/dev/loop') or \
+                    fs_type not in SPILL_FILESYSTEMS or 'ro' in options.split(',') or \
+                    mount_point in SPILL_EXCLUDED_MOUNTS or \
+                    mount_point.startswith(SPILL_EXCLUDED_MOUNT_PREFIXES) or device in devices:
+                continue
+            devices.add(device)
+            mounts.append(mount_point)
+    return sorted(mounts)
+
+
+def existing_ancestor(file_path):
+    while not path.exists(file_path):
+        file_path = path.dirname(file_path)
+    return file_path
+
+
+def spill_paths(config_properties, spill_mounts, spill_dir_name):
+    """
+    Returns one spill directory per data disk: on the configured spill_mounts,
+    otherwise on the detected data mounts, falling back to the configured
+    spiller-spill-path when there is no data disk.
+    """
+    mounts = spill_mounts or data_mounts()
+    if not mounts:
+        return [spill_path.strip() for spill_path in
+                str(config_properties['spiller-spill-path']).split(',') if spill_path.strip()]
+    paths = []
+    devices = set()
+    for mount in mounts:
+        # two configured mounts on the same disk share its bandwidth
+        device = os.stat(existing_ancestor(mount)).st_dev
+        if device not in devices:
+            devices.add(device)
+            paths.append(path.join(mount, spill_dir_name))
+    return paths
+
+
+def apply_spill_settings(config_properties, paths, disk_fraction, query_fraction):
+    """
+    Spread spilling over paths and size the spill limits from the capacity
+    of their disks. The capacity, unlike the free space, does not change with
+    ordinary disk usage, so the rendered config.properties is stable across
+    configures. Limits already present in config.properties take precedence.
+
+    Returns:
+        The config properties with the spill settings added
+    """
+    capacity = 0
+    devices = set()
+    for spill_path in paths:
+        existing = existing_ancestor(spill_path)
+        device = os.stat(existing).st_dev
+        if device in devices:
+            continue
+        devices.add(device)
+        stat = os.statvfs(existing)
+        capacity += stat.f_blocks * stat.f_frsize
+    max_spill = max(1, int(capacity * disk_fraction / 1024 ** 3))
+
+    properties = dict(config_properties)
+    properties['spiller-spill-path'] = ','.join(paths)
+    # a custom max-spill-per-node leaves the per query limit to the user too
+    if 'max-spill-per-node' not in properties:
+        properties['max-spill-per-node'] = '{0}GB'.format(max_spill)
+        if 'query-max-spill-per-node' not in properties:
+            properties['query-max-spill-per-node'] = '{0}GB'.format(
+                max(1, int(max_spill * query_fraction)))
+    return properties
+
+
+def provision_dirs(paths, owner):
+    for dir_path in paths:
+        if not path.isdir(dir_path):
+            os.makedirs(dir_path)
+        Execute('chown {0} {1}'.format(owner, dir_path))
+        os.chmod(dir_path, 0o750)
+
+
+def clean_spill_dirs():
+    """
+    Remove the spill files left behind by a server that did not shut down
+    cleanly. Does nothing while the server is running.
+    """
+    if fast_status() == STATUS_RUNNING:
+        return
+    for spill_path in configured_spill_paths():
+        if not path.isdir(spill_path):
+            continue
+        for name in os.listdir(spill_path):
+            file_path = path.join(spill_path, name)
+            if SPILL_FILE.match(name) and path.isfile(file_path):
+                os.remove(file_path)
+                Logger.info('Removed stale spill file {0}'.format(file_path))
+
+
+def spill_enabled(config_properties):
+    return str(config_properties.get('spill-enabled')).lower() == 'true'
+
+
+def configured_spill_paths():
+    from params import config_properties, spill_mounts, spill_dir_name
+    if not spill_enabled(config_properties):
+        return []
+    return spill_paths(config_properties, spill_mounts, spill_dir_name)
+
+
+def stable_node_id():
+    """
+    Returns the node.id of this host, generated once and kept in nodeIdPath
+    so that the node keeps its identity across restarts. Installs that
+    predate nodeIdPath keep the id found in their node.properties.
+    """
+    if path.isfile(nodeIdPath):
+        with open(nodeIdPath) as f:
+            node_id = f.read().strip()
+        if node_id:
+            return node_id
+
+    node_id = None
+    node_properties_path = path.join(etcDir, 'node.properties')
+    if path.isfile(node_properties_path):
+        with open(node_properties_path) as f:
+            for line in f:
+                if line.startswith('node.id='):
+                    node_id = line.split('=', 1)[1].strip()
+    if not node_id:
+        node_id = str(uuid.uuid4())
+    write_if_changed(nodeIdPath, node_id + '\n')
+    return node_id
+
+
+def write_if_changed(file_path, content):
+    """
+    Atomically replace file_path with content unless it already holds
+    exactly that content.
+
+    Returns:
+        True if the file was written
+    """
+    if path.isfile(file_path) and \
+            file_digest(file_path) == hashlib.sha256(content.encode('utf-8')).hexdigest():
+        return False
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.rename(tmp_path, file_path)
+    return True
+
+
+def render_configs(coordinator):
+    """
+    Render every configuration file in memory.
+
+    Returns:
+        File path -> content
+    """
     from params import node_properties, jvm_config, memory_configs, config_properties, \
-            connectors_to_add, connectors_to_delete, discoveryUri
+            connectors_to_add, connectors_to_delete, discoveryUri, memory_autotune, \
+            jvm_heap_fraction, worker_count, performance_profile, resource_groups_enabled, \
+            resource_groups_content, spill_disk_fraction, spill_query_fraction, \
+            templated_connectors_to_add, appcds_enabled
+
+    jvm_content = jvm_config['content']
+    if memory_autotune:
+        jvm_content, config_properties = autotune_memory(
+            config_properties, jvm_content, worker_count, jvm_heap_fraction)
+    config_properties = apply_performance_profile(config_properties, performance_profile)
+    if spill_enabled(config_properties):
+        config_properties = apply_spill_settings(config_properties, configured_spill_paths(),
+                                                 spill_disk_fraction, spill_query_fraction)
 
     key_val_template = '{0}={1}\n'
+    rendered = {}
 
-    with open(path.join(etcDir, 'node.properties'), 'w') as f:
-        for key, value in node_properties.iteritems():
-            f.write(key_val_template.format(key, value))
-        f.write(key_val_template.format('node.id', str(uuid.uuid4())))
+    lines = [key_val_template.format(key, value)
+             for key, value in sorted(node_properties.iteritems())]
+    lines.append(key_val_template.format('node.id', stable_node_id()))
+    rendered[path.join(etcDir, 'node.properties')] = ''.join(lines)
 
-    with open(path.join(etcDir, 'jvm.config'), 'w') as f:
-        f.write(jvm_config['content'])
+    archive = cds_archive_path() if appcds_enabled else None
+    if archive and path.isfile(archive):
+        jvm_content = apply_cds_archive(jvm_content, archive)
+    rendered[path.join(etcDir, 'jvm.config')] = jvm_content
 
-    # with open(path.join(etcDir, 'access-control.properties'), 'w') as f:
-    #     for key, value in access_control_properties.iteritems():
-    #         f.write(key_val_template.format(key, value))
+    # rendered[path.join(etcDir, 'access-control.properties')] = ''.join(
+    #     key_val_template.format(key, value)
+    #     for key, value in access_control_properties.iteritems())
 
     # rulesJsonFilePath = access_control_properties['security.config-file']
-    # with open(path.join(trinoHome, rulesJsonFilePath), 'w') as f:
-    #     f.write(rules_json['content'])
-
-    with open(path.join(etcDir, 'config.properties'), 'w') as f:
-        for key, value in config_properties.iteritems():
-            if key in memory_configs:
-                value += 'GB'
-            if key != 'coordinator.host':
-                f.write(key_val_template.format(key, value))
-        f.write(key_val_template.format('coordinator', coordinator))
-        f.write(key_val_template.format('discovery.uri', discoveryUri))
-        
-    create_connectors(connectors_to_add)
-    delete_connectors(connectors_to_delete)
-    create_connectors("{'tpch': ['connector.name=tpch']}")
+    # rendered[path.join(trinoHome, rulesJsonFilePath)] = rules_json['content']
+
+    lines = []
+    for key, value in sorted(config_properties.iteritems()):
+        if key in memory_configs:
+            value = '{0}GB'.format(size_in_gb(value))
+        if key != 'coordinator.host':
+            lines.append(key_val_template.format(key, value))
+    lines.append(key_val_template.format('coordinator', coordinator))
+    lines.append(key_val_template.format('discovery.uri', discoveryUri))
+    rendered[path.join(etcDir, 'config.properties')] = ''.join(lines)
+
+    if coordinator == 'true' and resource_groups_enabled:
+        # raises before anything is written if the tree is inconsistent
+        resource_groups = parse_resource_groups(resource_groups_content)
+        lines = [key_val_template.format('resource-groups.configuration-manager', 'file'),
+                 key_val_template.format('resource-groups.config-file', resourceGroupsJsonPath)]
+        rendered[resourceGroupsPropertiesPath] = ''.join(lines)
+        rendered[resourceGroupsJsonPath] = json.dumps(
+            resource_groups, indent=2, separators=(',', ': ')) + '\n'
+
+    catalogs = render_connectors(connectors_to_add)
+    catalogs.update(render_templated_connectors(templated_connectors_to_add, connectors_to_add))
+    if connectors_to_delete:
+        for connector in ast.literal_eval(connectors_to_delete):
+            catalogs.pop(os.path.join(catalogDir, connector + '.properties'), None)
+    catalogs.update(render_connectors("{'tpch': ['connector.name=tpch']}"))
+    rendered.update(catalogs)
+    return rendered
+
+
+def create_configure(coordinator):
+    """
+    Render the configuration and write only the files whose content changed.
+
+    Returns:
+        A dict with the 'changed' and 'removed' files, and whether the
+        running JVM needs a restart to pick them up ('restart_required')
+    """
+    from params import connectors_to_delete, templated_connectors_to_add, trino_user, \
+        appcds_enabled
+
+    rendered = render_configs(coordinator)
+    jvm_config_path = path.join(etcDir, 'jvm.config')
+    # the archive is dumped with the rendered heap settings, then referenced
+    if appcds_enabled and '-XX:SharedArchiveFile=' not in rendered[jvm_config_path] and \
+            generate_cds_archive(rendered[jvm_config_path]):
+        rendered = render_configs(coordinator)
+    provision_dirs(configured_spill_paths(), trino_user)
+    for catalog, spec in templated_catalogs(templated_connectors_to_add).items():
+        if spec.get('cache') and os.path.join(catalogDir, catalog + '.properties') in rendered:
+            provision_dirs(catalog_cache_dirs(catalog), trino_user)
+    changed = [file_path for file_path, content in sorted(rendered.items())
+               if write_if_changed(file_path, content)]
+    removed = delete_connectors(connectors_to_delete, rendered)
+    # resource groups were disabled
+    for file_path in (resourceGroupsPropertiesPath, resourceGroupsJsonPath):
+        if file_path not in rendered and path.exists(file_path):
+            os.remove(file_path)
+            removed.append(file_path)
+
+    for file_path in changed:
+        Logger.info('Updated {0}'.format(file_path))
+    for file_path in removed:
+        Logger.info('Removed {0}'.format(file_path))
+    return {'changed': changed,
+            'removed': removed,
+            'restart_required': bool(changed or removed)}
+
+
+def read_properties(file_path):
+    properties = {}
+    if not path.isfile(file_path):
+        return properties
+    with open(file_path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#') and '=' in line:
+                key, value = line.split('=', 1)
+                properties[key.strip()] = value.strip()
+    return properties
+
+
+def fast_status():
+    """
+    Check whether the server runs from the launcher pid file and /proc,
+    without starting the launcher. Only the rendered files in etcDir are
+    read, so this works with the limited configuration Ambari sends along
+    with status commands.
+
+    Returns:
+        STATUS_RUNNING, STATUS_STOPPED, or None when the result is unclear
+        and the launcher has to decide
+    """
+    node_properties = read_properties(path.join(etcDir, 'node.properties'))
+    data_dir = node_properties.get('node.data-dir')
+    if not data_dir:
+        return None
+    pid_file = path.join(data_dir, 'var', 'run', 'launcher.pid')
+    if not path.exists(pid_file):
+        return STATUS_STOPPED
+    try:
+        with open(pid_file) as f:
+            pid = int(f.read().strip())
+        with open('/proc/{0}/cmdline'.format(pid)) as f:
+            cmdline = f.read()
+    except ValueError:
+        return None
+    except IOError as e:
+        if e.errno == errno.ENOENT:
+            return STATUS_STOPPED
+        return None
+    if SERVER_MAIN_CLASS in cmdline:
+        return STATUS_RUNNING
+    return None
+
+
+def status_http_probe():
+    """
+    Returns:
+        True if status checks should ask the running server for its state,
+        read with default() as status commands carry a limited configuration
+    """
+    return str(default('/configurations/trino-env/status_http_probe', False)).lower() == 'true'
+
+
+def server_state():
+    """
+    Ask the local server for its state with one request and a short timeout.
+
+    Returns:
+        'starting', 'active' or 'shutting down', or None if the server does
+        not answer
+    """
+    from trino_client import TrinoClient
+
+    port = read_properties(path.join(etcDir, 'config.properties')).get('http-server.http.port')
+    if not port:
+        return None
+    client = TrinoClient('localhost', 'root', port, timeout=STATUS_TIMEOUT)
+    try:
+        # INACTIVE until the server has finished starting
+        return SERVER_STATES.get(client.get_server_json('/v1/info/state'))
+    finally:
+        client.close()
+
+
+def drain_server(timeout):
+    """
+    Put the local server in the SHUTTING_DOWN state and wait until it has
+    exited on its own, for at most timeout seconds.
+
+    Returns:
+        True if the server drained, False if it could not be asked to shut
+        down or was still running after timeout seconds
+    """
+    from trino_client import TrinoClient, drain
+
+    port = read_properties(path.join(etcDir, 'config.properties')).get('http-server.http.port')
+    if not port:
+        return False
+    client = TrinoClient('localhost', 'root', port, timeout=STATUS_TIMEOUT)
+    try:
+        Logger.info('Draining trino server, waiting up to {0} seconds'.format(timeout))
+        return drain(client, lambda: fast_status() == STATUS_STOPPED, timeout)
+    finally:
+        client.close()
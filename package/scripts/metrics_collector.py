@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Collects Trino cluster metrics and pushes them to Ambari Metrics.
+
+Runs as a standalone daemon started by the TRINO_METRICS_COLLECTOR
+component: python metrics_collector.py <config file>
+"""
+import json
+import logging
+import socket
+import sys
+import time
+from httplib import HTTPException
+from urllib import quote
+
+from trino_client import TrinoClient, ConnectionPoolManager
+
+APP_ID = 'trino'
+SCRAPE_TIMEOUT = 5
+# batches kept while Ambari Metrics is unreachable
+MAX_PENDING_BATCHES = 10
+
+# metric name -> field of the coordinator's /v1/cluster resource
+CLUSTER_METRICS = [
+    ('trino.cluster.running_queries', 'runningQueries'),
+    ('trino.cluster.queued_queries', 'queuedQueries'),
+    ('trino.cluster.blocked_queries', 'blockedQueries'),
+    ('trino.cluster.active_workers', 'activeWorkers'),
+    ('trino.cluster.running_drivers', 'runningDrivers'),
+    ('trino.cluster.reserved_memory', 'reservedMemory'),
+]
+
+# (metric name, mbean, attribute, cumulative) scraped on the coordinator
+COORDINATOR_MBEAN_METRICS = [
+    ('trino.memory.cluster.general.reserved_distributed_bytes',
+     'trino.memory:type=ClusterMemoryPool,name=general', 'ReservedDistributedBytes', False),
+    ('trino.memory.cluster.general.free_distributed_bytes',
+     'trino.memory:type=ClusterMemoryPool,name=general', 'FreeDistributedBytes', False),
+    ('trino.memory.cluster.general.blocked_nodes',
+     'trino.memory:type=ClusterMemoryPool,name=general', 'BlockedNodes', False),
+]
+
+# (metric name, mbean, attribute, cumulative) scraped on every node.
+# Cumulative counters are pushed as the increase since the previous scrape.
+NODE_MBEAN_METRICS = [
+    ('trino.memory.general.reserved_bytes',
+     'trino.memory:type=MemoryPool,name=general', 'ReservedBytes', False),
+    ('trino.memory.general.max_bytes',
+     'trino.memory:type=MemoryPool,name=general', 'MaxBytes', False),
+    ('trino.jvm.gc.young.time_ms',
+     'java.lang:type=GarbageCollector,name=G1 Young Generation', 'CollectionTime', True),
+    ('trino.jvm.gc.old.time_ms',
+     'java.lang:type=GarbageCollector,name=G1 Old Generation', 'CollectionTime', True),
+    ('trino.task_executor.waiting_splits',
+     'trino.execution.executor:name=TaskExecutor', 'WaitingSplits', False),
+    ('trino.task_executor.running_splits',
+     'trino.execution.executor:name=TaskExecutor', 'RunningSplits', False),
+]
+
+logging.basicConfig(stream=sys.stdout,
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+_LOGGER = logging.getLogger(__name__)
+
+
+class MetricsCollector:
+    """
+    Scrapes the coordinator and the workers and pushes every scrape to Ambari
+    Metrics in a single batch. All hosts are scraped over pooled keep-alive
+    connections.
+    """
+
+    def __init__(self, coordinator, workers, port, ams_url, user='root'):
+        self.coordinator = coordinator
+        self.workers = workers
+        self.port = port
+        self.ams_url = ams_url
+        self.user = user
+        self.pool_manager = ConnectionPoolManager(timeout=SCRAPE_TIMEOUT)
+        # (host, metric name) -> last value of cumulative counters
+        self.counters = {}
+        self.pending = []
+        # (mbean, attribute) already reported as missing
+        self.missing = set()
+
+    def client(self, host):
+        return TrinoClient(host, self.user, self.port, pool_manager=self.pool_manager,
+                           compression=False)
+
+    def mbean_attributes(self, client, mbean):
+        document = client.get_server_json('/v1/jmx/mbean/' + quote(mbean, safe=''))
+        if not document:
+            return {}
+        return dict((attribute.get('name'), attribute.get('value'))
+                    for attribute in document.get('attributes', []))
+
+    def scrape_mbeans(self, host, definitions):
+        client = self.client(host)
+        values = {}
+        attributes = {}
+        for name, mbean, attribute, cumulative in definitions:
+            if mbean not in attributes:
+                attributes[mbean] = self.mbean_attributes(client, mbean)
+            value = attributes[mbean].get(attribute)
+            if not isinstance(value, (int, long, float)):
+                # an unreachable host has no attributes at all, that is not worth a warning
+                if attributes[mbean] and (mbean, attribute) not in self.missing:
+                    self.missing.add((mbean, attribute))
+                    _LOGGER.warning('{0} has no numeric attribute {1}, not pushing {2}'.format(
+                        mbean, attribute, name))
+                continue
+            if cumulative:
+                previous = self.counters.get((host, name))
+                self.counters[(host, name)] = value
+                if previous is None or value < previous:
+                    continue
+                value -= previous
+            values[name] = value
+        return values
+
+    def scrape(self):
+        """
+        Returns:
+            host -> {metric name: value}
+        """
+        coordinator_values = {}
+        cluster = self.client(self.coordinator).get_server_json('/v1/cluster') or {}
+        for name, field in CLUSTER_METRICS:
+            if isinstance(cluster.get(field), (int, long, float)):
+                coordinator_values[name] = cluster[field]
+        coordinator_values.update(self.scrape_mbeans(self.coordinator, COORDINATOR_MBEAN_METRICS))
+        coordinator_values.update(self.scrape_mbeans(self.coordinator, NODE_MBEAN_METRICS))
+
+        scraped = {self.coordinator: coordinator_values}
+        for worker in self.workers:
+            scraped[worker] = self.scrape_mbeans(worker, NODE_MBEAN_METRICS)
+        return scraped
+
+    def build_batch(self, scraped, timestamp):
+        metrics = []
+        for host, values in scraped.items():
+            for name, value in values.items():
+                metrics.append({
+                    'metricname': name,
+                    'appid': APP_ID,
+                    'hostname': host,
+                    'timestamp': timestamp,
+                    'starttime': timestamp,
+                    'metrics': {str(timestamp): value},
+                })
+        return {'metrics': metrics}
+
+    def push(self, batch):
+        """
+        Send the batch, together with any batch that could not be sent
+        before, to Ambari Metrics.
+
+        Returns:
+            True if everything was sent
+        """
+        self.pending.append(batch)
+        self.pending = self.pending[-MAX_PENDING_BATCHES:]
+        while self.pending:
+            try:
+                response = self.pool_manager.urlopen(
+                    'POST', self.ams_url + '/ws/v1/timeline/metrics',
+                    json.dumps(self.pending[0]), {'Content-Type': 'application/json'})
+                response.read()
+                response.release()
+            except (HTTPException, socket.error) as e:
+                _LOGGER.warning('Failed to push metrics to {0}: {1}'.format(self.ams_url, e))
+                return False
+            if response.status != 200:
+                _LOGGER.warning('Failed to push metrics to {0}: {1} {2}'.format(
+                    self.ams_url, response.status, response.reason))
+                return False
+            self.pending.pop(0)
+        return True
+
+    def collect_once(self):
+        timestamp = int(time.time() * 1000)
+        scraped = self.scrape()
+        self.push(self.build_batch(scraped, timestamp))
+        return scraped
+
+    def run(self, interval):
+        while True:
+            started = time.time()
+            try:
+                self.collect_once()
+            except Exception as e:
+                _LOGGER.error('Metrics collection failed: ' + str(e))
+            time.sleep(max(0, interval - (time.time() - started)))
+
+
+def main(argv):
+    with open(argv[1]) as f:
+        config = json.load(f)
+    collector = MetricsCollector(config['coordinator'], config['workers'], config['port'],
+                                 config['ams_url'])
+    collector.run(config['interval'])
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from resource_management.libraries.functions.default import default
 from resource_management.libraries.script.script import Script
 
 # config object that holds the configurations declared in the config xml file
@@ -23,11 +24,16 @@ jvm_config = config['configurations']['jvm.config']
 config_properties = config['configurations']['config.properties']
 access_control_properties = config['configurations']['access-control.properties']
 rules_json = config['configurations']['rules.json']
+trino_env = config['configurations']['trino-env']
+resource_groups = config['configurations']['resource-groups']
 
 connectors_to_add = config['configurations']['connectors.properties']['connectors.to.add']
 connectors_to_delete = config['configurations']['connectors.properties']['connectors.to.delete']
+templated_connectors_to_add = \
+    config['configurations']['connectors.properties']['templated.connectors.to.add']
 
-memory_configs = ['query.max-memory-per-node', 'query.max-memory']
+memory_configs = ['query.max-memory-per-node', 'query.max-memory',
+                  'query.max-total-memory-per-node', 'memory.heap-headroom-per-node']
 coordinator_hosts = 'trino_coordinator_hosts'
 worker_hosts = 'trino_worker_hosts'
 
@@ -36,4 +42,64 @@ discoveryUri = 'http://{0}:{1}'.format(
     config['configurations']['config.properties']['http-server.http.port'])
 
 host_info = config['clusterHostInfo']
-host_level_params = config['hostLevelParams']
\ No newline at end of file
+host_level_params = config['hostLevelParams']
+
+readiness_timeout = int(trino_env['readiness_timeout'])
+worker_readiness_timeout = int(trino_env['worker_readiness_timeout'])
+artifact_cache_dir = trino_env['artifact_cache_dir']
+# in MB
+artifact_cache_max_size = int(trino_env['artifact_cache_max_size'])
+artifact_mirror_dir = trino_env['artifact_mirror_dir']
+
+# ConfigDictionary hands back 'true'/'false' as booleans
+memory_autotune = str(trino_env['memory_autotune']).lower() == 'true'
+jvm_heap_fraction = float(trino_env['jvm_heap_fraction'])
+worker_count = len(default('/clusterHostInfo/' + worker_hosts, []))
+if str(config_properties['node-scheduler.include-coordinator']).lower() == 'true':
+    worker_count += 1
+performance_profile = trino_env['performance_profile']
+
+drain_timeout = int(trino_env['drain_timeout'])
+rolling_restart_batch_size = int(trino_env['rolling_restart_batch_size'])
+ambari_admin_user = trino_env['ambari_admin_user']
+ambari_admin_password = trino_env['ambari_admin_password']
+cluster_name = config['clusterName']
+ambari_server_url = '{0}://{1}:{2}'.format(
+    'https' if str(default('/clusterHostInfo/ambari_server_use_ssl', ['false'])[0]).lower() == 'true' else 'http',
+    default('/clusterHostInfo/ambari_server_host', ['localhost'])[0],
+    default('/clusterHostInfo/ambari_server_port', ['8080'])[0])
+
+
+def comma_list(value):
+    return [item.strip() for item in str(value).split(',') if item.strip()]
+
+
+benchmark_suites = comma_list(trino_env['benchmark_suites'])
+benchmark_queries = comma_list(trino_env['benchmark_queries'])
+benchmark_scale_factors = comma_list(trino_env['benchmark_scale_factors'])
+benchmark_concurrency = [int(level) for level in comma_list(trino_env['benchmark_concurrency'])]
+benchmark_warmup_runs = int(trino_env['benchmark_warmup_runs'])
+benchmark_iterations = int(trino_env['benchmark_iterations'])
+benchmark_output_dir = trino_env['benchmark_output_dir']
+
+trino_user = trino_env['trino_user']
+appcds_enabled = str(trino_env['appcds_enabled']).lower() == 'true'
+spill_mounts = comma_list(trino_env['spill_mounts'])
+spill_dir_name = trino_env['spill_dir_name']
+spill_disk_fraction = float(trino_env['spill_disk_fraction'])
+spill_query_fraction = float(trino_env['spill_query_fraction'])
+
+resource_groups_enabled = str(resource_groups['resource_groups_enabled']).lower() == 'true'
+resource_groups_content = resource_groups['content']
+
+query_history_db = trino_env['query_history_db']
+query_history_top_n = int(trino_env['query_history_top_n'])
+query_history_order_by = str(trino_env['query_history_order_by'])
+
+metrics_interval = int(trino_env['metrics_interval'])
+metrics_collector_url = None
+if default('/clusterHostInfo/metrics_collector_hosts', []):
+    metrics_collector_url = 'http://{0}:{1}'.format(
+        default('/clusterHostInfo/metrics_collector_hosts', [])[0],
+        default('/configurations/ams-site/timeline.metrics.service.webapp.address',
+                '0.0.0.0:6188').split(':')[-1])
@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Harvests finished queries from system.runtime.queries and
+system.runtime.tasks into a local SQLite database, so that query history
+survives coordinator restarts, and reports the heaviest query shapes.
+
+Usage:
+    python query_history.py --db <path> harvest --server <host> --port <port>
+    python query_history.py --db <path> top --by cpu|memory|wall [-n 10]
+"""
+import argparse
+import hashlib
+import logging
+import os
+import os.path as path
+import re
+import sqlite3
+import sys
+
+from trino_client import TrinoClient
+from units import data_size_bytes
+
+logging.basicConfig(stream=sys.stdout)
+_LOGGER = logging.getLogger(__name__)
+
+PAGE_SIZE = 500
+TERMINAL_STATES = ('FINISHED', 'FAILED')
+
+QUERIES_PAGE = """select * from (
+    select query_id, state, "user", source, resource_group_id, query,
+        queued_time_ms, analysis_time_ms, planning_time_ms,
+        cast(to_unixtime(created) * 1000 as bigint) as created_ms,
+        cast(to_unixtime("end") * 1000 as bigint) as end_ms,
+        error_type, error_code
+    from system.runtime.queries)
+where created_ms > {0} or (created_ms = {0} and query_id > '{1}')
+order by created_ms, query_id
+limit {2}"""
+
+TASKS_BY_QUERY = """select query_id, count(*), sum(split_cpu_time_ms), sum(split_blocked_time_ms),
+    sum(raw_input_bytes), sum(raw_input_rows), sum(output_bytes), sum(physical_written_bytes)
+from system.runtime.tasks
+where query_id in ({0})
+group by query_id"""
+
+SCHEMA = [
+    """create table if not exists queries (
+        query_id text primary key,
+        state text,
+        user text,
+        source text,
+        resource_group text,
+        query text,
+        fingerprint text,
+        normalized_query text,
+        created_ms integer,
+        end_ms integer,
+        elapsed_ms integer,
+        queued_ms integer,
+        analysis_ms integer,
+        planning_ms integer,
+        cpu_ms integer,
+        blocked_ms integer,
+        peak_memory_bytes integer,
+        tasks integer,
+        input_bytes integer,
+        input_rows integer,
+        output_bytes integer,
+        written_bytes integer,
+        error_type text,
+        error_code text)""",
+    'create index if not exists queries_user on queries (user)',
+    'create index if not exists queries_source on queries (source)',
+    'create index if not exists queries_state on queries (state)',
+    'create index if not exists queries_elapsed on queries (elapsed_ms)',
+    'create index if not exists queries_fingerprint on queries (fingerprint)',
+    'create index if not exists queries_created on queries (created_ms)',
+    'create table if not exists harvest_state (name text primary key, value text)',
+]
+
+RECORD_COLUMNS = [
+    'query_id', 'state', 'user', 'source', 'resource_group', 'query', 'fingerprint',
+    'normalized_query', 'created_ms', 'end_ms', 'elapsed_ms', 'queued_ms', 'analysis_ms',
+    'planning_ms', 'cpu_ms', 'blocked_ms', 'peak_memory_bytes', 'tasks', 'input_bytes',
+    'input_rows', 'output_bytes', 'written_bytes', 'error_type', 'error_code',
+]
+
+# applied in order to turn a query into its fingerprint text
+NORMALIZATIONS = [
+    (re.compile(r'--[^\n]*'), ' '),
+    (re.compile(r'/\*.*?\*/', re.S), ' '),
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b'), '?'),
+    # IN lists of any length share a fingerprint
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(?)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+ORDER_BY = {
+    'cpu': 'total_cpu_ms',
+    'memory': 'max_peak_memory_bytes',
+    'wall': 'total_elapsed_ms',
+}
+
+
+def normalize_query(sql):
+    normalized = sql or ''
+    for pattern, replacement in NORMALIZATIONS:
+        normalized = pattern.sub(replacement, normalized)
+    return normalized.strip().lower()
+
+
+def fingerprint(normalized_query):
+    return hashlib.sha1(normalized_query.encode('utf-8')).hexdigest()[:16]
+
+
+def parse_data_size(value):
+    """
+    Returns:
+        the number of bytes of an airlift DataSize such as '1.5MB', or None
+    """
+    if isinstance(value, (int, long, float)):
+        return int(value)
+    return data_size_bytes(value)
+
+
+def sql_string(value):
+    return value.replace("'", "''")
+
+
+class QueryHistoryStore:
+    def __init__(self, db_path):
+        db_dir = path.dirname(db_path)
+        if db_dir and not path.isdir(db_dir):
+            os.makedirs(db_dir)
+        self.conn = sqlite3.connect(db_path)
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def high_water_mark(self):
+        """
+        Returns:
+            (created_ms, query_id) of the last harvested position
+        """
+        row = self.conn.execute(
+            "select value from harvest_state where name = 'high_water_mark'").fetchone()
+        if row is None:
+            return 0, ''
+        created_ms, query_id = row[0].split(' ', 1)
+        return int(created_ms), query_id
+
+    def set_high_water_mark(self, created_ms, query_id):
+        self.conn.execute("insert or replace into harvest_state values ('high_water_mark', ?)",
+                          ('{0} {1}'.format(created_ms, query_id),))
+
+    def add(self, records):
+        self.conn.executemany(
+            'insert or ignore into queries ({0}) values ({1})'.format(
+                ', '.join(RECORD_COLUMNS), ', '.join('?' * len(RECORD_COLUMNS))),
+            [tuple(record[column] for column in RECORD_COLUMNS) for record in records])
+
+    def top_queries(self, order_by='cpu', limit=10, since_ms=0, user=None, source=None,
+                    state=None):
+        """
+        Aggregate the stored queries per fingerprint.
+
+        Returns:
+            a list of dicts for the limit heaviest fingerprints by order_by
+        """
+        if order_by not in ORDER_BY:
+            raise ValueError('order_by must be one of ' + ', '.join(sorted(ORDER_BY)))
+        conditions = ['created_ms >= ?']
+        values = [since_ms]
+        for column, value in (('user', user), ('source', source), ('state', state)):
+            if value is not None:
+                conditions.append(column + ' = ?')
+                values.append(value)
+        cursor = self.conn.execute(
+            """select fingerprint, count(*) as executions,
+                   sum(cpu_ms) as total_cpu_ms, sum(elapsed_ms) as total_elapsed_ms,
+                   max(peak_memory_bytes) as max_peak_memory_bytes,
+                   avg(elapsed_ms) as avg_elapsed_ms,
+                   count(distinct user) as users, min(normalized_query) as query
+               from queries where {0}
+               group by fingerprint
+               order by {1} desc
+               limit ?""".format(' and '.join(conditions), ORDER_BY[order_by]),
+            values + [limit])
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+class QueryHistoryHarvester:
+    """
+    Copies finished queries into a QueryHistoryStore.
+
+    system.runtime.queries is paged in (created, query_id) order starting at
+    the stored high-water mark. The mark never moves past a query that is
+    still running, so that it is picked up once it finishes.
+    """
+
+    def __init__(self, client, store, page_size=PAGE_SIZE):
+        self.client = client
+        self.store = store
+        self.page_size = page_size
+
+    def peak_memory(self):
+        """
+        system.runtime.queries has no memory figures, take them from the
+        coordinator's query list.
+
+        Returns:
+            query id -> peak total memory in bytes
+        """
+        peaks = {}
+        for info in self.client.get_server_json('/v1/query') or []:
+            stats = info.get('queryStats', {})
+            peak = parse_data_size(stats.get('peakTotalMemoryReservation',
+                                             stats.get('peakUserMemoryReservation')))
+            if peak is not None:
+                peaks[info.get('queryId')] = peak
+        return peaks
+
+    def task_stats(self, query_ids):
+        stats = {}
+        sql = TASKS_BY_QUERY.format(', '.join("'" + sql_string(query_id) + "'"
+                                              for query_id in query_ids))
+        for row in self.client.iter_rows(sql, 'runtime', 'system'):
+            stats[row[0]] = row[1:]
+        return stats
+
+    def record(self, row, tasks, peak_memory):
+        (query_id, state, user, source, resource_group_id, query, queued_ms, analysis_ms,
+         planning_ms, created_ms, end_ms, error_type, error_code) = row
+        normalized = normalize_query(query)
+        task_count, cpu_ms, blocked_ms, input_bytes, input_rows, output_bytes, \
+            written_bytes = tasks.get(query_id, (None,) * 7)
+        return {
+            'query_id': query_id,
+            'state': state,
+            'user': user,
+            'source': source,
+            'resource_group': '.'.join(resource_group_id or []),
+            'query': query,
+            'fingerprint': fingerprint(normalized),
+            'normalized_query': normalized,
+            'created_ms': created_ms,
+            'end_ms': end_ms,
+            'elapsed_ms': end_ms - created_ms if end_ms is not None else None,
+            'queued_ms': queued_ms,
+            'analysis_ms': analysis_ms,
+            'planning_ms': planning_ms,
+            'cpu_ms': cpu_ms,
+            'blocked_ms': blocked_ms,
+            'peak_memory_bytes': peak_memory.get(query_id),
+            'tasks': task_count,
+            'input_bytes': input_bytes,
+            'input_rows': input_rows,
+            'output_bytes': output_bytes,
+            'written_bytes': written_bytes,
+            'error_type': error_type,
+            'error_code': error_code,
+        }
+
+    def harvest(self):
+        """
+        Returns:
+            the number of finished queries stored
+        """
+        created_ms, query_id = self.store.high_water_mark()
+        peak_memory = self.peak_memory()
+        first_unfinished = None
+        stored = 0
+        while True:
+            rows = list(self.client.iter_rows(
+                QUERIES_PAGE.format(created_ms, sql_string(query_id), self.page_size),
+                'runtime', 'system'))
+            finished = [row for row in rows if row[1] in TERMINAL_STATES]
+            if first_unfinished is None:
+                first_unfinished = next((row[9] for row in rows
+                                         if row[1] not in TERMINAL_STATES), None)
+            if finished:
+                tasks = self.task_stats([row[0] for row in finished])
+                self.store.add([self.record(row, tasks, peak_memory) for row in finished])
+                stored += len(finished)
+            if rows:
+                created_ms, query_id = rows[-1][9], rows[-1][0]
+            if len(rows) < self.page_size:
+                break
+
+        if first_unfinished is not None:
+            # resume just before the oldest running query
+            created_ms, query_id = first_unfinished - 1, ''
+        self.store.set_high_water_mark(created_ms, query_id)
+        self.store.conn.commit()
+        return stored
+
+
+def format_top(rows, order_by):
+    lines = ['Top {0} query fingerprints by {1}'.format(len(rows), order_by),
+             '{0:<16} {1:>6} {2:>12} {3:>12} {4:>14}  {5}'.format(
+                 'fingerprint', 'runs', 'cpu ms', 'wall ms', 'peak memory', 'query')]
+    for row in rows:
+        lines.append('{0:<16} {1:>6} {2:>12} {3:>12} {4:>14}  {5}'.format(
+            row['fingerprint'], row['executions'], row['total_cpu_ms'] or 0,
+            row['total_elapsed_ms'] or 0, row['max_peak_memory_bytes'] or 0,
+            (row['query'] or '')[:120]))
+    return '\n'.join(lines)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Trino query history')
+    parser.add_argument('--db', required=True, help='SQLite database file')
+    commands = parser.add_subparsers(dest='command')
+    harvest = commands.add_parser('harvest', help='copy finished queries from the coordinator')
+    harvest.add_argument('--server', default='localhost')
+    harvest.add_argument('--port', type=int, default=8285)
+    harvest.add_argument('--user', default='root')
+    top = commands.add_parser('top', help='list the heaviest query fingerprints')
+    top.add_argument('--by', choices=sorted(ORDER_BY), default='cpu')
+    top.add_argument('-n', type=int, default=10)
+    top.add_argument('--user')
+    top.add_argument('--source')
+    top.add_argument('--state')
+    args = parser.parse_args(argv[1:])
+
+    store = QueryHistoryStore(args.db)
+    try:
+        if args.command == 'harvest':
+            with TrinoClient(args.server, args.user, args.port) as client:
+                print('Stored {0} queries'.format(QueryHistoryHarvester(client, store).harvest()))
+        else:
+            print(format_top(store.top_queries(args.by, args.n, user=args.user,
+                                               source=args.source, state=args.state), args.by))
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Validation of file based resource group configurations.
+
+The checks mirror what Trino enforces when it loads resource-groups.json,
+plus a few consistency rules, so that a broken tree is rejected while the
+coordinator is still running instead of failing its startup.
+"""
+import json
+import re
+from collections import OrderedDict
+
+from units import duration_seconds, data_size_bytes
+
+SCHEDULING_POLICIES = ('fair', 'weighted', 'weighted_fair', 'query_priority')
+QUERY_TYPES = ('SELECT', 'EXPLAIN', 'DESCRIBE', 'INSERT', 'UPDATE', 'DELETE', 'ANALYZE',
+               'DATA_DEFINITION')
+
+MANAGER_KEYS = ('rootGroups', 'selectors', 'cpuQuotaPeriod')
+GROUP_KEYS = ('name', 'softMemoryLimit', 'maxQueued', 'softConcurrencyLimit',
+              'hardConcurrencyLimit', 'schedulingPolicy', 'schedulingWeight', 'subGroups',
+              'jmxExport', 'softCpuLimit', 'hardCpuLimit')
+SELECTOR_KEYS = ('user', 'source', 'queryType', 'clientTags', 'selectorResourceEstimate',
+                 'group')
+
+PERCENT = re.compile(r'^\s*(\d+(?:\.\d+)?)%\s*$')
+
+
+class InvalidResourceGroupsError(ValueError):
+    def __init__(self, errors):
+        ValueError.__init__(self, 'Invalid resource groups configuration:\n  ' +
+                            '\n  '.join(errors))
+        self.errors = errors
+
+
+def is_int(value):
+    return isinstance(value, (int, long)) and not isinstance(value, bool)
+
+
+def validate_group(group, parent, group_path, has_cpu_quota_period, errors, leaves):
+    if not isinstance(group, dict):
+        errors.append('{0}: a group must be an object'.format(group_path or 'rootGroups'))
+        return
+    name = group.get('name')
+    if not isinstance(name, basestring) or not name or '.' in name:
+        errors.append('{0}: name must be a non empty string without dots'.format(
+            group_path or 'rootGroups'))
+        return
+    group_path = group_path + '.' + name if group_path else name
+    for key in group:
+        if key not in GROUP_KEYS:
+            errors.append('{0}: unknown property {1}'.format(group_path, key))
+
+    for key in ('hardConcurrencyLimit', 'maxQueued'):
+        if not is_int(group.get(key)) or group[key] < 0:
+            errors.append('{0}: {1} must be a non negative integer'.format(group_path, key))
+    soft_concurrency = group.get('softConcurrencyLimit')
+    if soft_concurrency is not None:
+        if not is_int(soft_concurrency) or soft_concurrency < 0:
+            errors.append('{0}: softConcurrencyLimit must be a non negative integer'.format(
+                group_path))
+        elif is_int(group.get('hardConcurrencyLimit')) and \
+                soft_concurrency > group['hardConcurrencyLimit']:
+            errors.append('{0}: softConcurrencyLimit is above hardConcurrencyLimit'.format(
+                group_path))
+
+    memory = group.get('softMemoryLimit')
+    percent = PERCENT.match(memory) if isinstance(memory, basestring) else None
+    if percent and float(percent.group(1)) > 100:
+        errors.append('{0}: softMemoryLimit cannot exceed 100%'.format(group_path))
+    elif not percent and data_size_bytes(memory) is None:
+        errors.append('{0}: softMemoryLimit must be a percentage or a data size such as '
+                      '10GB'.format(group_path))
+
+    policy = group.get('schedulingPolicy')
+    if policy is not None and policy not in SCHEDULING_POLICIES:
+        errors.append('{0}: schedulingPolicy must be one of {1}'.format(
+            group_path, ', '.join(SCHEDULING_POLICIES)))
+    weight = group.get('schedulingWeight')
+    if weight is not None and (not is_int(weight) or weight <= 0):
+        errors.append('{0}: schedulingWeight must be a positive integer'.format(group_path))
+    if 'jmxExport' in group and not isinstance(group['jmxExport'], bool):
+        errors.append('{0}: jmxExport must be true or false'.format(group_path))
+
+    cpu_limits = {}
+    for key in ('softCpuLimit', 'hardCpuLimit'):
+        if key in group:
+            cpu_limits[key] = duration_seconds(group[key])
+            if cpu_limits[key] is None:
+                errors.append('{0}: {1} must be a duration such as 1h'.format(group_path, key))
+            elif not has_cpu_quota_period:
+                errors.append('{0}: {1} requires cpuQuotaPeriod'.format(group_path, key))
+    if cpu_limits.get('softCpuLimit') is not None and \
+            cpu_limits.get('hardCpuLimit') is not None and \
+            cpu_limits['softCpuLimit'] > cpu_limits['hardCpuLimit']:
+        errors.append('{0}: softCpuLimit is above hardCpuLimit'.format(group_path))
+
+    if parent is not None:
+        # a sub-group can never get more than its parent allows
+        if is_int(group.get('hardConcurrencyLimit')) and \
+                is_int(parent.get('hardConcurrencyLimit')) and \
+                group['hardConcurrencyLimit'] > parent['hardConcurrencyLimit']:
+            errors.append('{0}: hardConcurrencyLimit is above the parent limit'.format(
+                group_path))
+        parent_memory = parent.get('softMemoryLimit')
+        parent_percent = PERCENT.match(parent_memory) \
+            if isinstance(parent_memory, basestring) else None
+        if percent and parent_percent and \
+                float(percent.group(1)) > float(parent_percent.group(1)):
+            errors.append('{0}: softMemoryLimit is above the parent limit'.format(group_path))
+        if parent.get('schedulingPolicy') == 'query_priority' and policy != 'query_priority':
+            errors.append('{0}: sub-groups of a query_priority group must also use '
+                          'query_priority'.format(group_path))
+
+    sub_groups = group.get('subGroups', [])
+    if not isinstance(sub_groups, list):
+        errors.append('{0}: subGroups must be a list'.format(group_path))
+        return
+    if not sub_groups:
+        leaves.add(group_path)
+    validate_siblings(sub_groups, group, group_path, has_cpu_quota_period, errors, leaves)
+
+
+def validate_siblings(groups, parent, parent_path, has_cpu_quota_period, errors, leaves):
+    names = [group.get('name') for group in groups if isinstance(group, dict)]
+    for name in sorted(set(name for name in names if names.count(name) > 1)):
+        errors.append('{0}: duplicate group {1}'.format(parent_path or 'rootGroups', name))
+    for group in groups:
+        validate_group(group, parent, parent_path, has_cpu_quota_period, errors, leaves)
+
+
+def validate_selector(index, selector, leaves, errors):
+    selector_path = 'selectors[{0}]'.format(index)
+    if not isinstance(selector, dict):
+        errors.append(selector_path + ': a selector must be an object')
+        return
+    for key in selector:
+        if key not in SELECTOR_KEYS:
+            errors.append('{0}: unknown property {1}'.format(selector_path, key))
+    for key in ('user', 'source'):
+        if key in selector:
+            try:
+                re.compile(selector[key])
+            except (re.error, TypeError):
+                errors.append('{0}: {1} is not a valid regular expression'.format(
+                    selector_path, key))
+    if 'queryType' in selector and selector['queryType'] not in QUERY_TYPES:
+        errors.append('{0}: queryType must be one of {1}'.format(
+            selector_path, ', '.join(QUERY_TYPES)))
+    if 'clientTags' in selector and not isinstance(selector['clientTags'], list):
+        errors.append(selector_path + ': clientTags must be a list')
+    group = selector.get('group')
+    if group not in leaves:
+        # queries can only be admitted to leaf groups
+        errors.append('{0}: group {1} is not a leaf group of rootGroups'.format(
+            selector_path, group))
+
+
+def validate_resource_groups(manager):
+    """
+    Returns:
+        a list of human readable problems, empty if the tree is consistent
+    """
+    if not isinstance(manager, dict):
+        return ['the configuration must be a JSON object']
+    errors = []
+    for key in manager:
+        if key not in MANAGER_KEYS:
+            errors.append('unknown property ' + key)
+    has_cpu_quota_period = 'cpuQuotaPeriod' in manager
+    if has_cpu_quota_period and not duration_seconds(manager['cpuQuotaPeriod']):
+        errors.append('cpuQuotaPeriod must be a positive duration such as 1h')
+
+    root_groups = manager.get('rootGroups')
+    leaves = set()
+    if not isinstance(root_groups, list) or not root_groups:
+        errors.append('rootGroups must be a non empty list')
+    else:
+        validate_siblings(root_groups, None, '', has_cpu_quota_period, errors, leaves)
+
+    selectors = manager.get('selectors')
+    if not isinstance(selectors, list) or not selectors:
+        errors.append('selectors must be a non empty list, otherwise no query is admitted')
+    else:
+        for index, selector in enumerate(selectors):
+            validate_selector(index, selector, leaves, errors)
+    return errors
+
+
+def parse_resource_groups(content):
+    """
+    Parse and validate the resource groups JSON, keeping the key order.
+
+    Raises:
+        InvalidResourceGroupsError if the content is not valid
+    """
+    try:
+        manager = json.loads(content, object_pairs_hook=OrderedDict)
+    except ValueError as e:
+        raise InvalidResourceGroupsError(['not valid JSON: ' + str(e)])
+    errors = validate_resource_groups(manager)
+    if errors:
+        raise InvalidResourceGroupsError(errors)
+    return manager
@@ -15,108 +15,665 @@
 """
 Simple client to communicate with a trino server.
 """
+import Queue
 import json
 import logging
+import random
+import select
 import socket
 import sys
+import threading
 import time
-from httplib import HTTPConnection, HTTPException
-from urllib2 import HTTPError, urlopen, URLError
+import zlib
+from httplib import HTTPConnection, HTTPException, BadStatusLine
+from urlparse import urlsplit
 
 URL_TIMEOUT_MS = 5000
+POOL_MAX_SIZE = 4
+POOL_IDLE_TIMEOUT = 30
+# requests that can be repeated on a fresh connection after a stale one failed
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'DELETE')
+PAGE_CHUNK_SIZE = 64 * 1024
 NUM_ROWS = 1000
+MAX_IN_FLIGHT = 8
 DATA_RESP = 'data'
 NEXT_URI_RESP = 'nextUri'
+ERROR_RESP = 'error'
+ID_RESP = 'id'
+INFO_URI_RESP = 'infoUri'
+STATS_RESP = 'stats'
+# fields of the server 'stats' object kept in the query metrics
+SERVER_STATS = ('state', 'queuedTimeMillis', 'elapsedTimeMillis', 'cpuTimeMillis',
+                'processedRows', 'processedBytes', 'peakMemoryBytes')
 RETRY_TIMEOUT = 120
 SYSTEM_RUNTIME_NODES = 'select * from system.runtime.nodes'
 SHOW_CATALOGS = 'show catalogs'
+NODE_STATE = "select state from system.runtime.nodes where node_id = '{0}'"
 SLEEP_INTERVAL = 10
+BACKOFF_INITIAL = 0.25
 
 logging.basicConfig(stream=sys.stdout)
 _LOGGER = logging.getLogger(__name__)
 
 
-def smoketest_trino(client, all_hosts):
-    ensure_nodes_are_up(client, all_hosts)
-    ensure_catalogs_are_available(client)
-    client.execute_query('select * from nation', schema='sf1', catalog='tpch')
+def smoketest_trino(client, all_hosts, timeout=RETRY_TIMEOUT):
+    wait_until_ready(client, all_hosts, timeout)
+    if not client.execute_query('select * from nation', schema='sf1', catalog='tpch'):
+        raise RuntimeError('trino server failed to run the smoketest query on the nation '
+                           'table in TPCH connector')
     rows = client.get_rows()
     if len(rows) != 25:
         raise RuntimeError('trino server failed to return the correct \
 number of rows from nation table in TPCH connector. Expected 25 but got {0}'.format(len(rows)))
 
 
-def ensure_catalogs_are_available(client):
-    rows = []
-    elapsed_time = 0
-    while elapsed_time < RETRY_TIMEOUT:
-        client.execute_query(SHOW_CATALOGS)
-        rows = client.get_rows()
-        if not rows:
-            time.sleep(SLEEP_INTERVAL)
-            _LOGGER.debug('Failed to load catalogs after '
-                          'waiting for %d seconds. Retrying...' % elapsed_time)
-            elapsed_time += SLEEP_INTERVAL
-        else:
-            break
+def backoff_delays(initial=BACKOFF_INITIAL, maximum=SLEEP_INTERVAL):
+    """
+    Exponential backoff with jitter: every delay is picked at random between
+    half and all of the current step, and the step doubles up to maximum.
+    """
+    step = initial
+    while True:
+        yield step / 2 + random.uniform(0, step / 2)
+        step = min(step * 2, maximum)
+
+
+def poll_until_ready(check, timeout, what, max_delay=SLEEP_INTERVAL):
+    """
+    Call check with backoff, up to max_delay seconds between calls, until it
+    returns None, which means ready, or timeout seconds have passed. Any
+    other value returned by check describes what is still pending.
+
+    Raises:
+        RuntimeError if not ready within timeout seconds
+    """
+    deadline = time.time() + timeout
+    delays = backoff_delays(maximum=max_delay)
+    while True:
+        pending = check()
+        if pending is None:
+            return
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise RuntimeError('{0} was not ready within {1:.0f} seconds: '
+                               '{2}'.format(what, timeout, pending))
+        _LOGGER.debug('{0} not ready yet ({1}). Retrying...'.format(what, pending))
+        time.sleep(min(next(delays), remaining))
+
+
+def wait_until_started(client, timeout=RETRY_TIMEOUT):
+    """
+    Wait until the server behind client reports in /v1/info that it has
+    finished starting. Polls at least every second, the time it returns at
+    is used as the start time of the server.
+
+    Raises:
+        RuntimeError if the server has not started within timeout seconds
+    """
+    poll_until_ready(lambda: check_started(client), timeout, 'trino server', max_delay=1)
+
+
+def wait_until_ready(client, all_hosts, timeout=RETRY_TIMEOUT):
+    """
+    Wait until the coordinator has finished starting, every host has
+    registered with the discovery service and the catalogs are loaded.
+
+    Raises:
+        RuntimeError if the cluster is not ready within timeout seconds
+    """
+    poll_until_ready(lambda: check_readiness(client, all_hosts), timeout, 'trino server')
+
+
+def wait_until_worker_ready(local_client, coordinator_client, node_id, timeout=RETRY_TIMEOUT):
+    """
+    Wait until a worker has finished starting and the coordinator lists it
+    as an active node, so that it can be scheduled splits.
+
+    Raises:
+        RuntimeError if the worker is not ready within timeout seconds
+    """
+    poll_until_ready(lambda: check_worker_readiness(local_client, coordinator_client, node_id),
+                     timeout, 'trino worker {0}'.format(node_id))
+
+
+def drain(client, has_exited, timeout):
+    """
+    Put the server behind client in the SHUTTING_DOWN state and wait until
+    has_exited() is true. After the shutdown grace period Trino waits for
+    its running tasks and then exits on its own, so the exit of the process
+    is what marks the server as drained.
+
+    Returns:
+        True if the server drained, False if it could not be asked to shut
+        down or had not exited after timeout seconds
+    """
+    if not client.set_server_state('SHUTTING_DOWN'):
+        return False
+    try:
+        poll_until_ready(lambda: None if has_exited() else 'server is still draining',
+                         timeout, 'trino server drain')
+    except RuntimeError:
+        return False
+    return True
+
+
+def check_worker_readiness(local_client, coordinator_client, node_id):
+    """
+    Returns:
+        None if the worker is ready, otherwise a description of what it is
+        still waiting for
+    """
+    pending = check_started(local_client, 'worker')
+    if pending is not None:
+        return pending
+
+    if not coordinator_client.execute_query(NODE_STATE.format(node_id.replace("'", "''"))):
+        return 'failed to query the coordinator'
+    rows = coordinator_client.get_rows()
     if not rows:
-        raise RuntimeError('trino server failed to load all catalogs within \
-{0} seconds.'.format(RETRY_TIMEOUT))
-
-
-def ensure_nodes_are_up(client, all_hosts):
-    result = True
-    elapsed_time = 0
-    while elapsed_time < RETRY_TIMEOUT:
-        result = client.execute_query(SYSTEM_RUNTIME_NODES)
-        if not result:
-            time.sleep(SLEEP_INTERVAL)
-            _LOGGER.debug('Status retrieval for the server failed after '
-                          'waiting for %d seconds. Retrying...' % elapsed_time)
-            elapsed_time += SLEEP_INTERVAL
-        else:
-            break
-    if not result:
-        raise RuntimeError('trino server failed to start within \
-{0} seconds.'.format(RETRY_TIMEOUT))
+        return 'worker is not registered with the coordinator'
+    if rows[0][0] != 'active':
+        return 'worker is {0} on the coordinator'.format(rows[0][0])
+    return None
+
+
+def check_started(client, what='server'):
+    """
+    Returns:
+        None if the server has finished starting, otherwise why not
+    """
+    info = client.get_server_json('/v1/info')
+    if info is None:
+        return '{0} is not reachable'.format(what)
+    if info.get('starting', True):
+        return '{0} is starting'.format(what)
+    return None
+
+
+def check_readiness(client, all_hosts):
+    """
+    Run one round of readiness checks, cheapest first.
+
+    Returns:
+        None if the cluster is ready, otherwise a description of what it is
+        still waiting for
+    """
+    pending = check_started(client)
+    if pending is not None:
+        return pending
+
+    # /v1/node is a cheap lower bound on the number of registered nodes, the
+    # coordinator may or may not list itself
+    nodes = client.get_server_json('/v1/node')
+    if nodes is None or len(nodes) < len(all_hosts) - 1:
+        return 'waiting for nodes to register with the discovery service'
 
     # Verify that the nodes we expect to have registered with the Discovery
     # service have actually registered correctly
-    elapsed_time = 0
-    are_expected_nodes_up = False
-    while elapsed_time < RETRY_TIMEOUT:
-        client.execute_query(SYSTEM_RUNTIME_NODES)
-        nodes_returned_from_trino = []
-        for row in client.get_rows():
-            nodes_returned_from_trino.append(row[0])
-        if len(nodes_returned_from_trino) == len(all_hosts):
-            are_expected_nodes_up = True
-            break
+    if not client.execute_query(SYSTEM_RUNTIME_NODES):
+        return 'failed to query {0}'.format(SYSTEM_RUNTIME_NODES)
+    nodes_returned_from_trino = [row[0] for row in client.get_rows()]
+    if len(nodes_returned_from_trino) != len(all_hosts):
+        return 'nodes returned from trino {0} do not match the hosts specified by ' \
+               'user {1}'.format(nodes_returned_from_trino, all_hosts)
+
+    if not client.execute_query(SHOW_CATALOGS) or not client.get_rows():
+        return 'catalogs are not loaded'
+    return None
+
+
+class PooledResponse:
+    """
+    Response read from a pooled connection.
+
+    The underlying connection goes back to its pool on release() once the
+    body has been fully consumed, otherwise it is closed.
+    """
+
+    def __init__(self, pool, conn, response):
+        self.pool = pool
+        self.conn = conn
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+        # bytes received on the wire, before decompression
+        self.bytes_read = 0
+        self.gzipped = (response.getheader('Content-Encoding') or '').lower() == 'gzip'
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def read(self):
+        """
+        Read the whole body, decompressed if the server gzipped it.
+        """
+        return ''.join(self.iter_content())
+
+    def iter_content(self, chunk_size=PAGE_CHUNK_SIZE):
+        """
+        Yield the body chunk by chunk as it arrives, decompressing gzipped
+        bodies on the fly.
+        """
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if self.gzipped else None
+        while True:
+            chunk = self.response.read(chunk_size)
+            if not chunk:
+                break
+            self.bytes_read += len(chunk)
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk)
+                if not chunk:
+                    continue
+            yield chunk
+        if decompressor is not None:
+            tail = decompressor.flush()
+            if tail:
+                yield tail
+
+    def release(self):
+        if self.conn is None:
+            return
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.put(self.conn)
         else:
-            time.sleep(SLEEP_INTERVAL)
-            _LOGGER.debug('Elapsed time {0}'.format(elapsed_time))
-            _LOGGER.debug(
-                'Number of hosts returned from trino {0} do not match number of hosts specified by user {1}'.format(
-                    nodes_returned_from_trino, all_hosts))
-            elapsed_time += SLEEP_INTERVAL
-    if not are_expected_nodes_up:
-        raise RuntimeError(
-            'Number of hosts returned from trino {0} do not equal the number of hosts specified by user {1}'.format(
-                nodes_returned_from_trino, all_hosts))
+            self.conn.close()
+        self.conn = None
+
+
+class PageDecoder:
+    """
+    Incremental decoder of one statement protocol page.
+
+    The page is read chunk by chunk and every row of 'data' is yielded as
+    soon as it is complete, so neither the whole page text nor the whole
+    decoded page has to be held in memory. All other fields of the page end
+    up in fields.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.fields = {}
+        self.decoder = json.JSONDecoder()
+        self.decode_time = 0.0
+
+    def fill(self):
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.eof = True
+            return
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def next_char(self):
+        """
+        Consume and return the next non whitespace character.
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                self.pos += 1
+                return self.buffer[self.pos - 1]
+            if self.eof:
+                raise ValueError('Unexpected end of page')
+            self.fill()
+
+    def expect(self, chars):
+        char = self.next_char()
+        if char not in chars:
+            raise ValueError('Expected one of {0!r} in page but got {1!r}'.format(chars, char))
+        return char
+
+    def value(self):
+        """
+        Decode the next JSON value, reading more of the page until it is
+        complete.
+        """
+        # skip whitespace, then step back onto the first character
+        self.next_char()
+        self.pos -= 1
+        while True:
+            started = time.time()
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # a number at the very end of the buffer may be truncated
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            finally:
+                self.decode_time += time.time() - started
+            self.fill()
+
+    def rows(self):
+        self.expect('{')
+        if self.expect('"}') == '}':
+            return
+        self.pos -= 1
+        while True:
+            key = self.value()
+            self.expect(':')
+            if key == DATA_RESP:
+                self.expect('[')
+                if self.next_char() != ']':
+                    self.pos -= 1
+                    while True:
+                        yield self.value()
+                        if self.expect(',]') == ']':
+                            break
+            else:
+                self.fields[key] = self.value()
+            if self.expect(',}') == '}':
+                return
+
+
+def connection_dropped(conn):
+    """
+    Returns:
+        True if an idle keep-alive connection can no longer be used. Nothing
+        is expected on an idle connection, so a readable socket means the
+        server closed it or sent something out of turn.
+    """
+    if conn.sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (select.error, socket.error, ValueError):
+        return True
+    return bool(readable)
+
+
+class HTTPConnectionPool:
+    """
+    Pool of HTTP/1.1 keep-alive connections to a single host:port.
+
+    Idle connections older than idle_timeout seconds are evicted when the pool
+    is accessed, and an idle connection the server has already closed is
+    dropped before it is reused. A request sent on a reused connection that
+    still turns out to be stale is retried once on a fresh connection, if it
+    is idempotent.
+    """
+
+    def __init__(self, host, port, max_size=POOL_MAX_SIZE,
+                 idle_timeout=POOL_IDLE_TIMEOUT, timeout=URL_TIMEOUT_MS):
+        self.host = host
+        self.port = int(port)
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        # (connection, last used timestamp), most recently used last
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def new_connection(self):
+        return HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def get(self):
+        """
+        Returns a (connection, reused) tuple.
+        """
+        now = time.time()
+        with self.lock:
+            while self.idle:
+                conn, last_used = self.idle.pop()
+                if now - last_used < self.idle_timeout and not connection_dropped(conn):
+                    return conn, True
+                conn.close()
+        return self.new_connection(), False
+
+    def put(self, conn):
+        with self.lock:
+            self.evict_idle()
+            if len(self.idle) < self.max_size:
+                self.idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def evict_idle(self):
+        now = time.time()
+        fresh = []
+        for conn, last_used in self.idle:
+            if now - last_used < self.idle_timeout:
+                fresh.append((conn, last_used))
+            else:
+                conn.close()
+        self.idle = fresh
+
+    def request(self, method, url, body=None, headers=None):
+        """
+        Sends a request and returns a PooledResponse. The caller must call
+        release() on the response once it is done reading it.
+        """
+        conn, reused = self.get()
+        sent = False
+        try:
+            conn.request(method, url, body, headers or {})
+            sent = True
+            response = conn.getresponse()
+        except (BadStatusLine, socket.error):
+            conn.close()
+            # once a request is sent the server may have acted on it, only
+            # idempotent ones can be repeated, a POST could submit twice
+            if not reused or (sent and method not in IDEMPOTENT_METHODS):
+                raise
+            _LOGGER.debug('Stale connection to %s:%d, reconnecting'
+                          % (self.host, self.port))
+            conn = self.new_connection()
+            try:
+                conn.request(method, url, body, headers or {})
+                response = conn.getresponse()
+            except (HTTPException, socket.error):
+                conn.close()
+                raise
+        except HTTPException:
+            conn.close()
+            raise
+        return PooledResponse(self, conn, response)
+
+    def close(self):
+        with self.lock:
+            for conn, _ in self.idle:
+                conn.close()
+            self.idle = []
+
+
+class ConnectionPoolManager:
+    """
+    Keeps one HTTPConnectionPool per host:port.
+    """
+
+    def __init__(self, max_size=POOL_MAX_SIZE, idle_timeout=POOL_IDLE_TIMEOUT,
+                 timeout=URL_TIMEOUT_MS):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.pools = {}
+        self.lock = threading.Lock()
+
+    def pool_for(self, host, port):
+        key = (host, int(port))
+        with self.lock:
+            if key not in self.pools:
+                self.pools[key] = HTTPConnectionPool(
+                    host, port, self.max_size, self.idle_timeout, self.timeout)
+            return self.pools[key]
+
+    def urlopen(self, method, uri, body=None, headers=None):
+        """
+        Sends a request to an absolute uri such as the 'nextUri' returned by
+        the server.
+        """
+        parts = urlsplit(uri)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        pool = self.pool_for(parts.hostname, parts.port or 80)
+        return pool.request(method, path, body, headers)
+
+    def close(self):
+        with self.lock:
+            for pool in self.pools.values():
+                pool.close()
+            self.pools = {}
 
 
 # This class was copied more or less verbatim from
 # https://github.com/trinosql/trino-admin/blob/master/trinoadmin/trinoclient.py
 class TrinoClient:
-    response_from_server = {}
-    # rows returned by the query
-    rows = []
-    next_uri = ''
-
-    def __init__(self, server, user, port=None):
+    def __init__(self, server, user, port=None, pool_size=POOL_MAX_SIZE,
+                 pool_idle_timeout=POOL_IDLE_TIMEOUT, timeout=URL_TIMEOUT_MS,
+                 pool_manager=None, compression=True):
         self.server = server
         self.user = user
         self.port = port if port else None
+        self.response_from_server = {}
+        # rows returned by the query
+        self.rows = []
+        self.next_uri = ''
+        self.query_id = None
+        # query id -> latest 'nextUri' of every query that has not finished
+        self.running_queries = {}
+        # query id -> metrics of every query that has not finished
+        self.query_metrics = {}
+        self.listeners = []
+        self.pool_manager = pool_manager or \
+            ConnectionPoolManager(pool_size, pool_idle_timeout, timeout)
+        # ask the server to gzip result pages
+        self.compression = compression
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cancel_all_queries()
+        self.close()
+        return False
+
+    def close(self):
+        """
+        Closes all idle pooled connections.
+        """
+        self.pool_manager.close()
+
+    def add_listener(self, listener):
+        """
+        Register a callable invoked with the metrics dict of every query
+        once it finishes, fails or is cancelled. The metrics hold the
+        client side 'wall_time_ms', 'time_to_first_row_ms', 'pages',
+        'bytes_received' and 'decode_time_ms', the 'info_uri', the
+        'outcome' and the last server side 'stats'.
+
+        Queries run through execute_many report from their session threads,
+        so the listener has to be thread safe.
+        """
+        self.listeners.append(listener)
+
+    def track_query(self, response, size=0, decode_time=0, started=None, sql=None):
+        """
+        Remember the latest 'nextUri' of a query until the server stops
+        returning one, so that abandoned queries can be cancelled, and
+        record the page in the query metrics.
+        """
+        query_id = response.get(ID_RESP)
+        if not query_id:
+            return
+        self.record_page(query_id, response, size, decode_time, started, sql)
+        if NEXT_URI_RESP in response:
+            self.running_queries[query_id] = response[NEXT_URI_RESP]
+        else:
+            self.running_queries.pop(query_id, None)
+            self.finish_query(query_id, 'failed' if ERROR_RESP in response else 'finished')
+
+    def request_headers(self):
+        headers = {'X-trino-User': self.user}
+        if self.compression:
+            headers['Accept-Encoding'] = 'gzip'
+        return headers
+
+    def note_first_row(self, query_id, received=None):
+        metrics = self.query_metrics.get(query_id)
+        if metrics is not None and metrics['time_to_first_row_ms'] is None:
+            received = received or time.time()
+            metrics['time_to_first_row_ms'] = int((received - metrics['submitted']) * 1000)
+
+    def record_page(self, query_id, response, size, decode_time, started, sql):
+        now = time.time()
+        metrics = self.query_metrics.get(query_id)
+        if metrics is None:
+            metrics = {'query_id': query_id, 'sql': sql, 'submitted': started or now,
+                       'pages': 0, 'bytes_received': 0, 'decode_time_ms': 0.0,
+                       'time_to_first_row_ms': None, 'info_uri': None, 'stats': {}}
+            self.query_metrics[query_id] = metrics
+        metrics['pages'] += 1
+        metrics['bytes_received'] += size
+        metrics['decode_time_ms'] += decode_time * 1000
+        if response.get(DATA_RESP):
+            self.note_first_row(query_id)
+        if INFO_URI_RESP in response:
+            metrics['info_uri'] = response[INFO_URI_RESP]
+        stats = response.get(STATS_RESP)
+        if stats:
+            metrics['stats'] = dict((key, stats.get(key)) for key in SERVER_STATS)
+
+    def finish_query(self, query_id, outcome):
+        """
+        Complete the metrics of a query, log them as a structured line and
+        pass them to the listeners.
+        """
+        metrics = self.query_metrics.pop(query_id, None)
+        if metrics is None:
+            return
+        metrics['outcome'] = outcome
+        metrics['wall_time_ms'] = int((time.time() - metrics.pop('submitted')) * 1000)
+        metrics['decode_time_ms'] = round(metrics['decode_time_ms'], 3)
+        _LOGGER.info('query_metrics ' + json.dumps(metrics, sort_keys=True))
+        for listener in self.listeners:
+            try:
+                listener(metrics)
+            except Exception as e:
+                _LOGGER.error('Query metrics listener failed: ' + str(e))
+
+    def cancel_query(self, query_id=None):
+        """
+        Cancel a query started by this client by sending a DELETE to its
+        latest 'nextUri'. Defaults to the most recently executed query.
+
+        Returns:
+            True if the server acknowledged the cancellation, False if the
+            query is not running or the request failed
+        """
+        if query_id is None:
+            query_id = self.query_id
+        uri = self.running_queries.pop(query_id, None)
+        if not uri:
+            return False
+        self.finish_query(query_id, 'cancelled')
+        try:
+            response = self.pool_manager.urlopen('DELETE', uri, None, self.request_headers())
+            response.read()
+            response.release()
+        except (HTTPException, socket.error) as e:
+            _LOGGER.error('Error cancelling query {0}: {1}'.format(query_id, e))
+            return False
+        if response.status not in (200, 204):
+            _LOGGER.error('Error cancelling query {0}: {1} {2}'.format(
+                query_id, response.status, response.reason))
+            return False
+        _LOGGER.info('Cancelled query ' + query_id)
+        return True
+
+    def cancel_all_queries(self):
+        """
+        Cancel every query started by this client that is still running.
+        """
+        for query_id in list(self.running_queries.keys()):
+            self.cancel_query(query_id)
 
     def clear_old_results(self):
         if self.rows:
@@ -128,6 +685,8 @@ class TrinoClient:
         if self.response_from_server:
             self.response_from_server = {}
 
+        self.query_id = None
+
     def execute_query(self, sql, schema='sf1', catalog='tpch'):
         """
         Execute a query connecting to trino server using passed parameters.
@@ -159,28 +718,30 @@ class TrinoClient:
 
         self.clear_old_results()
 
-        headers = {'X-trino-Catalog': catalog,
-                   'X-trino-Schema': schema,
-                   'X-trino-User': self.user}
+        headers = self.request_headers()
+        headers.update({'X-trino-Catalog': catalog,
+                        'X-trino-Schema': schema})
         answer = ''
         try:
             _LOGGER.info('Connecting to server at: ' + self.server +
                          ':' + str(self.port) + ' as user ' + self.user)
-            conn = HTTPConnection(self.server, int(self.port), False,
-                                  URL_TIMEOUT_MS)
-            conn.request('POST', '/v1/statement', sql, headers)
-            response = conn.getresponse()
+            started = time.time()
+            pool = self.pool_manager.pool_for(self.server, self.port)
+            response = pool.request('POST', '/v1/statement', sql, headers)
+            answer = response.read()
+            response.release()
 
             if response.status != 200:
-                conn.close()
                 _LOGGER.error('Connection error: '
                               + str(response.status) + ' ' + response.reason)
                 return False
 
-            answer = response.read()
-            conn.close()
-
+            decode_started = time.time()
             self.response_from_server = json.loads(answer)
+            decode_time = time.time() - decode_started
+            self.query_id = self.response_from_server.get(ID_RESP)
+            self.track_query(self.response_from_server, response.bytes_read, decode_time,
+                             started, sql)
             _LOGGER.info('Query executed successfully')
             return True
         except (HTTPException, socket.error):
@@ -192,32 +753,132 @@ class TrinoClient:
                           ' error from server: ' + answer)
             raise e
 
+    def get_server_json(self, path, method='GET', value=None):
+        """
+        Sends a request for one of the server's REST resources, such as
+        '/v1/info'. When value is given it is sent as the JSON body.
+
+        Returns:
+            The decoded JSON document, or None if the request failed
+        """
+        answer = self.send_server_request(path, method, value)
+        if answer is None:
+            return None
+        try:
+            return json.loads(answer)
+        except ValueError:
+            return None
+
+    def set_server_state(self, state):
+        """
+        Asks the server to change its node state, e.g. to SHUTTING_DOWN.
+        The server answers with an empty body, only the status counts.
+
+        Returns:
+            True if the server accepted the state
+        """
+        return self.send_server_request('/v1/info/state', 'PUT', state) is not None
+
+    def send_server_request(self, path, method='GET', value=None):
+        """
+        Sends a request for one of the server's REST resources. When value
+        is given it is sent as the JSON body.
+
+        Returns:
+            The body of a 2xx answer, or None if the request failed
+        """
+        headers = self.request_headers()
+        body = None
+        if value is not None:
+            headers['Content-Type'] = 'application/json'
+            body = json.dumps(value)
+        try:
+            pool = self.pool_manager.pool_for(self.server, self.port)
+            response = pool.request(method, path, body, headers)
+            answer = response.read()
+            response.release()
+        except (HTTPException, socket.error) as e:
+            _LOGGER.debug('Error requesting {0}: {1}'.format(path, e))
+            return None
+
+        if not 200 <= response.status < 300:
+            _LOGGER.debug('Error requesting {0}: {1} {2}'.format(
+                path, response.status, response.reason))
+            return None
+        return answer
+
     def get_response_from(self, uri):
         """
         Sends a GET request to the trino server at the specified next_uri
         and updates the response
         """
         try:
-            conn = urlopen(uri, None, URL_TIMEOUT_MS)
-            answer = conn.read()
-            conn.close()
+            response = self.pool_manager.urlopen('GET', uri, None, self.request_headers())
+            answer = response.read()
+            response.release()
+        except (HTTPException, socket.error) as e:
+            _LOGGER.error('Error opening the trino response uri: ' + str(e))
+            return False
 
-            self.response_from_server = json.loads(answer)
-            _LOGGER.info('GET request successful for uri: ' + uri)
-            return True
-        except (HTTPError, URLError) as e:
+        if response.status != 200:
             _LOGGER.error('Error opening the trino response uri: ' +
-                          str(e.reason))
+                          str(response.status) + ' ' + response.reason)
             return False
 
+        decode_started = time.time()
+        self.response_from_server = json.loads(answer)
+        self.track_query(self.response_from_server, response.bytes_read,
+                         time.time() - decode_started)
+        _LOGGER.info('GET request successful for uri: ' + uri)
+        return True
+
+    def stream_response_from(self, uri):
+        """
+        Sends a GET request to the trino server at the specified next_uri
+        and yields the rows of the page while it is still downloading. Once
+        the page is consumed response_from_server holds the page without its
+        'data'.
+
+        Raises:
+            RuntimeError if the page cannot be fetched or decoded
+        """
+        try:
+            response = self.pool_manager.urlopen('GET', uri, None, self.request_headers())
+        except (HTTPException, socket.error) as e:
+            raise RuntimeError('Failed to fetch query results from {0}: {1}'.format(uri, e))
+        try:
+            if response.status != 200:
+                raise RuntimeError('Failed to fetch query results from {0}: {1} {2}'.format(
+                    uri, response.status, response.reason))
+            decoder = PageDecoder(response.iter_content())
+            first_row_received = None
+            for row in decoder.rows():
+                if first_row_received is None:
+                    first_row_received = time.time()
+                yield row
+            # drain anything after the closing brace so the connection can be reused
+            for _ in decoder.chunks:
+                pass
+        except (HTTPException, socket.error, ValueError, zlib.error) as e:
+            raise RuntimeError('Failed to fetch query results from {0}: {1}'.format(uri, e))
+        finally:
+            response.release()
+
+        self.response_from_server = decoder.fields
+        if first_row_received is not None:
+            self.note_first_row(decoder.fields.get(ID_RESP), first_row_received)
+        self.track_query(decoder.fields, response.bytes_read, decoder.decode_time)
+
     def build_results_from_response(self):
         """
         Build result from the response
 
         The reponse_from_server may contain up to 3 uri's.
         1. link to fetch the next packet of data ('nextUri')
-        2. TODO: information about the query execution ('infoUri')
-        3. TODO: cancel the query ('partialCancelUri').
+        2. information about the query execution ('infoUri'), kept in the
+           query metrics, see add_listener
+        3. TODO: cancel the query ('partialCancelUri'). Whole queries are
+           cancelled through 'nextUri' instead, see cancel_query.
         """
         if NEXT_URI_RESP in self.response_from_server:
             self.next_uri = self.response_from_server[NEXT_URI_RESP]
@@ -240,12 +901,14 @@ class TrinoClient:
         finished
 
         Note that this can only be called once and does not page through
-        the results.
+        the results. Once more than num_of_rows rows have been collected, or
+        a page cannot be fetched, the query is cancelled on the server.
 
         Parameters:
             num_of_rows: to be retrieved. 1000 by default
         """
         if num_of_rows == 0:
+            self.cancel_query()
             return []
 
         self.build_results_from_response()
@@ -255,14 +918,150 @@ class TrinoClient:
 
         while self.get_next_uri():
             if not self.get_response_from(self.get_next_uri()):
+                self.cancel_query()
                 return []
-            if len(self.rows) <= num_of_rows:
-                self.build_results_from_response()
+            if len(self.rows) > num_of_rows:
+                self.cancel_query()
+                break
+            self.build_results_from_response()
         return self.rows
 
     def get_next_uri(self):
         return self.next_uri
 
+    def iter_rows(self, sql, schema='sf1', catalog='tpch'):
+        """
+        Execute a query and yield its rows page by page.
+
+        Unlike get_rows, pages are decoded incrementally and rows are yielded
+        while each page is still downloading, so memory use stays constant
+        and this is suitable for large system.runtime.* scans.
+        If the iteration stops early or fails the query is cancelled.
+
+        Raises:
+            RuntimeError if the query cannot be submitted, a page cannot be
+            fetched or the server reports a query error
+        """
+        if not self.execute_query(sql, schema, catalog):
+            raise RuntimeError('Failed to submit query to trino server: ' + sql)
+
+        query_id = self.query_id
+        try:
+            while True:
+                response = self.response_from_server
+                if ERROR_RESP in response:
+                    raise RuntimeError('Query failed: {0}'.format(
+                        response[ERROR_RESP].get('message')))
+                # only the first page still carries its 'data', later pages
+                # are streamed by stream_response_from
+                for row in response.get(DATA_RESP) or []:
+                    yield row
+                self.next_uri = response.get(NEXT_URI_RESP, '')
+                if not self.next_uri:
+                    return
+                for row in self.stream_response_from(self.next_uri):
+                    yield row
+        finally:
+            # no-op if the query ran to completion
+            self.cancel_query(query_id)
+
+    def execute_many(self, queries, max_in_flight=MAX_IN_FLIGHT, timeout=RETRY_TIMEOUT):
+        """
+        Execute queries concurrently and yield their results as each one
+        finishes.
+
+        At most max_in_flight queries run at the same time, each in its own
+        session sharing this client's connection pools. A query still running
+        after timeout seconds is cancelled. If the caller stops iterating,
+        the queries in flight are cancelled as well.
+
+        Args:
+            queries: SQL strings, or (sql, schema, catalog) tuples
+            max_in_flight: maximum number of concurrent queries
+            timeout: seconds allowed for each query
+
+        Yields:
+            Dicts with the 'index' of the query in queries, its 'sql',
+            'rows', final 'stats', 'elapsed' seconds and an 'error' message
+            or None
+        """
+        pending = Queue.Queue()
+        for index, query in enumerate(queries):
+            if not isinstance(query, tuple):
+                query = (query, 'sf1', 'tpch')
+            pending.put((index,) + query)
+        total = pending.qsize()
+        results = Queue.Queue()
+        stopped = threading.Event()
+
+        def session():
+            client = TrinoClient(self.server, self.user, self.port,
+                                 pool_manager=self.pool_manager, compression=self.compression)
+            # report the queries of every session to this client's listeners
+            client.listeners = self.listeners
+            while not stopped.is_set():
+                try:
+                    index, sql, schema, catalog = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    result = client.run_with_deadline(sql, schema, catalog, timeout, stopped)
+                except Exception as e:
+                    result = {'sql': sql, 'rows': [], 'stats': None, 'elapsed': 0,
+                              'error': str(e)}
+                result['index'] = index
+                results.put(result)
+
+        threads = [threading.Thread(target=session)
+                   for _ in range(min(max_in_flight, total))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            for _ in range(total):
+                yield results.get()
+        finally:
+            stopped.set()
+            for thread in threads:
+                thread.join()
+
+    def run_with_deadline(self, sql, schema, catalog, timeout, stopped=None):
+        """
+        Execute a query and collect all of its rows, cancelling it once
+        timeout seconds have passed or the stopped event is set.
+        """
+        started = time.time()
+        result = {'sql': sql, 'rows': [], 'stats': None, 'elapsed': 0, 'error': None}
+        if not self.execute_query(sql, schema, catalog):
+            result['error'] = 'Failed to submit query to trino server'
+            return result
+
+        query_id = self.query_id
+        while True:
+            response = self.response_from_server
+            result['stats'] = response.get('stats')
+            if ERROR_RESP in response:
+                result['error'] = 'Query failed: {0}'.format(response[ERROR_RESP].get('message'))
+                break
+            result['rows'].extend(response.get(DATA_RESP) or [])
+            self.next_uri = response.get(NEXT_URI_RESP, '')
+            if not self.next_uri:
+                break
+            if time.time() - started > timeout:
+                result['error'] = 'Query timed out after {0} seconds'.format(timeout)
+                break
+            if stopped is not None and stopped.is_set():
+                result['error'] = 'Query cancelled'
+                break
+            if not self.get_response_from(self.next_uri):
+                result['error'] = 'Failed to fetch query results from ' + self.next_uri
+                break
+
+        # no-op if the query ran to completion
+        self.cancel_query(query_id)
+        result['elapsed'] = time.time() - started
+        return result
+
 
 class InvalidArgumentError(ValueError):
     pass
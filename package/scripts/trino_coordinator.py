@@ -13,12 +13,19 @@
 # limitations under the License.
 
 import os.path as path
+import time
 from resource_management.core.exceptions import ExecutionFailed, ComponentIsNotRunning
+from resource_management.core.logger import Logger
 from resource_management.core.resources.system import Execute
 from resource_management.libraries.script.script import Script
 
-from common import create_configure, deploying, launcherPath, exportJavaHomeAndPath
-from trino_client import smoketest_trino, TrinoClient
+from common import create_configure, deploying, launcherPath, exportJavaHomeAndPath, \
+    fast_status, server_state, status_http_probe, render_configs, clean_spill_dirs, \
+    record_startup, startup_report, STATUS_RUNNING, STATUS_STOPPED
+from ambari_client import AmbariClient
+from benchmark import BenchmarkRunner, format_summary, save_results
+from query_history import QueryHistoryHarvester, QueryHistoryStore, format_top
+from trino_client import smoketest_trino, wait_until_ready, wait_until_started, TrinoClient
 
 class Coordinator(Script):
     def install(self, env):
@@ -26,20 +33,81 @@ class Coordinator(Script):
         self.configure(env)
 
     def stop(self, env):
+        # system.runtime.queries does not survive the restart
+        if fast_status() == STATUS_RUNNING:
+            try:
+                self.harvest_query_history()
+            except Exception as e:
+                Logger.warning('Failed to harvest query history before stopping: ' + str(e))
         Execute(exportJavaHomeAndPath + ' && {0} stop'.format(launcherPath))
 
+    def restart(self, env):
+        # reject an inconsistent configuration while the old server still runs
+        render_configs('true')
+        Script.restart(self, env)
+
     def start(self, env):
         self.configure(self)
+        clean_spill_dirs()
+        from params import config_properties, readiness_timeout
+        started = time.time()
+        # one deadline for the whole start, both phases get what is left of it
+        deadline = started + readiness_timeout
         Execute(exportJavaHomeAndPath + ' && {0} start'.format(launcherPath))
-        from params import config_properties, host_info, worker_hosts, coordinator_hosts
+        with TrinoClient(config_properties['coordinator.host'], 'root',
+                         config_properties['http-server.http.port']) as client:
+            wait_until_started(client, max(0, deadline - time.time()))
+            record_startup(time.time() - started)
+            smoketest_trino(client, self.all_hosts(), max(0, deadline - time.time()))
+
+    def all_hosts(self):
+        from params import host_info, worker_hosts, coordinator_hosts
         if worker_hosts in host_info.keys():
-            all_hosts = host_info[worker_hosts] + \
-                        host_info[coordinator_hosts]
-        else:
-            all_hosts = host_info[coordinator_hosts]
-        smoketest_trino(TrinoClient(config_properties['coordinator.host'], 'root', config_properties['http-server.http.port']), all_hosts)
+            return host_info[worker_hosts] + \
+                   host_info[coordinator_hosts]
+        return host_info[coordinator_hosts]
+
+    def rolling_restart_workers(self, env):
+        """
+        Restart the workers in batches of rolling_restart_batch_size through
+        Ambari. Every batch is drained by the worker stop, and the next batch
+        only starts once all nodes are registered with the coordinator again.
+        Workers on a coordinator host are skipped, restarting them would take
+        down the coordinator that waits for the batch.
+        """
+        from params import config_properties, host_info, worker_hosts, coordinator_hosts, \
+            readiness_timeout, rolling_restart_batch_size, ambari_server_url, cluster_name, \
+            ambari_admin_user, ambari_admin_password
+        workers = host_info[worker_hosts] if worker_hosts in host_info.keys() else []
+        coordinators = set(host_info[coordinator_hosts]) \
+            if coordinator_hosts in host_info.keys() else set()
+        skipped = [host for host in workers if host in coordinators]
+        if skipped:
+            Logger.warning('Not restarting the workers on coordinator hosts {0}, restart them '
+                           'with the coordinator'.format(', '.join(skipped)))
+        workers = [host for host in workers if host not in coordinators]
+        batches = [workers[i:i + rolling_restart_batch_size]
+                   for i in range(0, len(workers), rolling_restart_batch_size)]
+        ambari = AmbariClient(ambari_server_url, cluster_name,
+                              ambari_admin_user, ambari_admin_password)
+        with TrinoClient(config_properties['coordinator.host'], 'root',
+                         config_properties['http-server.http.port']) as client:
+            for number, batch in enumerate(batches, 1):
+                context = 'Rolling restart of Trino workers, batch {0} of {1}'.format(
+                    number, len(batches))
+                Logger.info('{0}: {1}'.format(context, ', '.join(batch)))
+                ambari.restart_components('TRINO', 'TRINO_WORKER', batch, context)
+                wait_until_ready(client, self.all_hosts(), readiness_timeout)
 
     def status(self, env):
+        status = fast_status()
+        if status == STATUS_RUNNING:
+            if status_http_probe():
+                Logger.info('Trino server state: {0}'.format(server_state()))
+            return
+        if status == STATUS_STOPPED:
+            raise ComponentIsNotRunning("ComponentIsNotRunning")
+
         try:
             Execute(exportJavaHomeAndPath + ' && {0} status'.format(launcherPath))
         except ExecutionFailed as ef:
@@ -48,8 +116,74 @@ class Coordinator(Script):
             else:
                 raise ef
 
+    def run_benchmark(self, env):
+        """
+        Run the configured TPC-H / TPC-DS suites and save the results as
+        JSON in benchmark_output_dir.
+        """
+        from params import config_properties, benchmark_suites, benchmark_queries, \
+            benchmark_scale_factors, benchmark_concurrency, benchmark_warmup_runs, \
+            benchmark_iterations, benchmark_output_dir
+
+        def client_factory():
+            return TrinoClient(config_properties['coordinator.host'], 'root',
+                               config_properties['http-server.http.port'])
+
+        runner = BenchmarkRunner(client_factory, benchmark_warmup_runs,
+                                 benchmark_iterations, benchmark_queries)
+        summaries = runner.run(benchmark_suites, benchmark_scale_factors, benchmark_concurrency)
+        Logger.info(format_summary(summaries))
+        Logger.info('Benchmark results saved to {0}'.format(
+            save_results(summaries, benchmark_output_dir)))
+
+    def harvest_query_history(self):
+        from params import config_properties, query_history_db
+        store = QueryHistoryStore(query_history_db)
+        try:
+            with TrinoClient(config_properties['coordinator.host'], 'root',
+                             config_properties['http-server.http.port']) as client:
+                stored = QueryHistoryHarvester(client, store).harvest()
+            Logger.info('Stored {0} finished queries in {1}'.format(stored, query_history_db))
+        finally:
+            store.close()
+
+    def query_history(self, env):
+        """
+        Harvest the finished queries and log the heaviest query fingerprints.
+        """
+        from params import query_history_db, query_history_top_n, query_history_order_by
+        self.harvest_query_history()
+        store = QueryHistoryStore(query_history_db)
+        try:
+            Logger.info(format_top(store.top_queries(query_history_order_by, query_history_top_n),
+                                   query_history_order_by))
+        finally:
+            store.close()
+
+    def startup_report(self, env):
+        """
+        Log the recorded start times of this host without and with AppCDS.
+        """
+        Logger.info(startup_report())
+
     def configure(self, env):
-        create_configure('true')
+        return create_configure('true')
+
+    def apply_configs(self, env):
+        """
+        Render the configuration and restart the server only if a file
+        actually changed.
+        """
+        changes = self.configure(env)
+        if not changes['restart_required']:
+            Logger.info('Configuration is unchanged, not restarting')
+            return
+        try:
+            self.status(env)
+        except ComponentIsNotRunning:
+            return
+        self.stop(env)
+        self.start(env)
 
 if __name__ == '__main__':
     Coordinator().execute()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import os.path as path
+import sys
+from resource_management.core.exceptions import ComponentIsNotRunning, Fail
+from resource_management.core.logger import Logger
+from resource_management.core.resources.system import Execute
+from resource_management.libraries.script.script import Script
+
+from common import write_if_changed
+
+collectorDir = '/var/run/trino-metrics-collector/'
+collectorConfigPath = collectorDir + 'collector.json'
+collectorPidPath = collectorDir + 'collector.pid'
+collectorLogPath = '/var/log/trino-metrics-collector.log'
+collectorScript = path.join(path.dirname(path.abspath(__file__)), 'metrics_collector.py')
+
+
+def collector_pid():
+    try:
+        with open(collectorPidPath) as f:
+            pid = int(f.read().strip())
+    except (IOError, ValueError):
+        return None
+    # a stale pid file may point to a recycled pid
+    try:
+        with open('/proc/{0}/cmdline'.format(pid)) as f:
+            cmdline = f.read()
+    except IOError:
+        return None
+    return pid if path.basename(collectorScript) in cmdline else None
+
+
+class MetricsCollector(Script):
+    def install(self, env):
+        self.configure(env)
+
+    def configure(self, env):
+        from params import config_properties, host_info, coordinator_hosts, worker_hosts, \
+            metrics_interval, metrics_collector_url
+        if not metrics_collector_url:
+            raise Fail('Ambari Metrics is not installed, there is nowhere to push Trino metrics')
+        if not path.isdir(collectorDir):
+            os.makedirs(collectorDir)
+        config = {
+            # Ambari host names, so that the metrics line up with the components
+            'coordinator': host_info[coordinator_hosts][0],
+            'workers': sorted(host_info.get(worker_hosts, [])),
+            'port': int(config_properties['http-server.http.port']),
+            'ams_url': metrics_collector_url,
+            'interval': metrics_interval,
+        }
+        return write_if_changed(collectorConfigPath, json.dumps(config, indent=2, sort_keys=True))
+
+    def stop(self, env):
+        pid = collector_pid()
+        if pid is not None:
+            Execute('kill {0}'.format(pid))
+        if path.isfile(collectorPidPath):
+            os.remove(collectorPidPath)
+
+    def start(self, env):
+        if self.configure(env):
+            self.stop(env)
+        if collector_pid() is not None:
+            return
+        Execute('nohup {0} {1} {2} >> {3} 2>&1 & echo $! > {4}'.format(
+            sys.executable, collectorScript, collectorConfigPath, collectorLogPath,
+            collectorPidPath))
+        Logger.info('Trino metrics collector started, logging to ' + collectorLogPath)
+
+    def status(self, env):
+        if collector_pid() is None:
+            raise ComponentIsNotRunning("ComponentIsNotRunning")
+
+
+if __name__ == '__main__':
+    MetricsCollector().execute()
@@ -13,11 +13,16 @@
 # limitations under the License.
 
 import os.path as path
+import time
 from resource_management.core.exceptions import ExecutionFailed, ComponentIsNotRunning
+from resource_management.core.logger import Logger
 from resource_management.core.resources.system import Execute
 from resource_management.libraries.script.script import Script
 
-from common import create_configure, deploying, launcherPath, exportJavaHomeAndPath
+from common import create_configure, deploying, launcherPath, exportJavaHomeAndPath, \
+    fast_status, server_state, status_http_probe, drain_server, read_properties, etcDir, \
+    clean_spill_dirs, record_startup, startup_report, STATUS_RUNNING, STATUS_STOPPED
+from trino_client import wait_until_started, wait_until_worker_ready, TrinoClient
 
 class Worker(Script):
     def install(self, env):
@@ -25,13 +30,37 @@ class Worker(Script):
         self.configure(env)
 
     def stop(self, env):
+        from params import drain_timeout
+        if not drain_server(drain_timeout):
+            Logger.warning('Trino worker was not drained gracefully, stopping it anyway')
         Execute(exportJavaHomeAndPath + ' && {0} stop'.format(launcherPath))
 
     def start(self, env):
         self.configure(self)
+        clean_spill_dirs()
+        from params import config_properties, worker_readiness_timeout
+        started = time.time()
+        # one deadline for the whole start, both phases get what is left of it
+        deadline = started + worker_readiness_timeout
         Execute(exportJavaHomeAndPath + ' && {0} start'.format(launcherPath))
+        node_id = read_properties(path.join(etcDir, 'node.properties'))['node.id']
+        port = config_properties['http-server.http.port']
+        with TrinoClient('localhost', 'root', port) as local_client, \
+                TrinoClient(config_properties['coordinator.host'], 'root', port) as coordinator_client:
+            wait_until_started(local_client, max(0, deadline - time.time()))
+            record_startup(time.time() - started)
+            wait_until_worker_ready(local_client, coordinator_client, node_id,
+                                    max(0, deadline - time.time()))
 
     def status(self, env):
+        status = fast_status()
+        if status == STATUS_RUNNING:
+            if status_http_probe():
+                Logger.info('Trino server state: {0}'.format(server_state()))
+            return
+        if status == STATUS_STOPPED:
+            raise ComponentIsNotRunning("ComponentIsNotRunning")
+
         try:
             Execute(exportJavaHomeAndPath + ' && {0} status'.format(launcherPath))
         except ExecutionFailed as ef:
@@ -40,8 +69,30 @@ class Worker(Script):
             else:
                 raise ef
 
+    def startup_report(self, env):
+        """
+        Log the recorded start times of this host without and with AppCDS.
+        """
+        Logger.info(startup_report())
+
     def configure(self, env):
-        create_configure('false')
+        return create_configure('false')
+
+    def apply_configs(self, env):
+        """
+        Render the configuration and restart the server only if a file
+        actually changed.
+        """
+        changes = self.configure(env)
+        if not changes['restart_required']:
+            Logger.info('Configuration is unchanged, not restarting')
+            return
+        try:
+            self.status(env)
+        except ComponentIsNotRunning:
+            return
+        self.stop(env)
+        self.start(env)
 
 if __name__ == '__main__':
     Worker().execute()
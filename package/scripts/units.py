@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Airlift duration and data size values as used in Trino configuration
+files and REST resources, e.g. '10m' or '1.5GB'.
+"""
+import re
+
+DURATION = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*(ns|us|ms|s|m|h|d)\s*$')
+DURATION_SECONDS = {'ns': 1e-9, 'us': 1e-6, 'ms': 1e-3, 's': 1, 'm': 60, 'h': 3600,
+                    'd': 86400}
+DATA_SIZE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*(B|kB|MB|GB|TB|PB)\s*$')
+DATA_SIZE_UNITS = {'B': 0, 'kB': 1, 'MB': 2, 'GB': 3, 'TB': 4, 'PB': 5}
+
+
+def duration_seconds(value):
+    """
+    Returns:
+        The duration string value in seconds, or None if it is not one
+    """
+    match = DURATION.match(value) if isinstance(value, basestring) else None
+    if not match:
+        return None
+    return float(match.group(1)) * DURATION_SECONDS[match.group(2)]
+
+
+def data_size_bytes(value):
+    """
+    Returns:
+        The data size string value in bytes, or None if it is not one
+    """
+    match = DATA_SIZE.match(value) if isinstance(value, basestring) else None
+    if not match:
+        return None
+    return int(float(match.group(1)) * 1024 ** DATA_SIZE_UNITS[match.group(2)])
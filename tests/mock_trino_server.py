@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A minimal Trino statement protocol server for tests.
+
+POST /v1/statement answers with a query id and a nextUri, every GET of a
+nextUri returns one page of rows and the last page carries the final
+stats. How a query behaves is chosen by the first rule whose substring
+occurs in its SQL. The node state can be read and set like on a real
+server through /v1/info/state. A server created with gzip=True compresses
+its answers for clients that accept it.
+"""
+import gzip
+import json
+import socket
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from StringIO import StringIO
+
+PAGE_SIZE = 10
+
+
+class QueryRule:
+    def __init__(self, match, rows=None, delay=0, error=None, garbage=False, truncate=False):
+        self.match = match
+        self.rows = rows if rows is not None else [[1]]
+        # seconds the first result page is held back
+        self.delay = delay
+        # message of a query failure reported on the first page
+        self.error = error
+        # answer the POST with something that is not JSON
+        self.garbage = garbage
+        # cut every result page in half
+        self.truncate = truncate
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def base(self):
+        return 'http://{0}:{1}'.format(*self.server.server_address)
+
+    def send_body(self, body, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if body and self.server.gzip and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            out = StringIO()
+            with gzip.GzipFile(fileobj=out, mode='wb') as f:
+                f.write(body)
+            body = out.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+            with self.server.lock:
+                self.server.gzipped_responses += 1
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        sql = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        rule = self.server.rule_for(sql)
+        if rule.garbage:
+            return self.send_body('<html>proxy error</html>')
+        query_id = self.server.new_query(rule)
+        self.send_body(json.dumps({
+            'id': query_id,
+            'infoUri': '{0}/ui/query.html?{1}'.format(self.base(), query_id),
+            'nextUri': '{0}/v1/statement/executing/{1}/0'.format(self.base(), query_id),
+            'stats': {'state': 'QUEUED'},
+        }))
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path != '/v1/info/state':
+            return self.send_body('{}', 404)
+        self.server.set_state(json.loads(body))
+        # Trino acknowledges a state change with an empty body
+        self.send_body('')
+
+    def do_GET(self):
+        if self.path == '/v1/info/state':
+            return self.send_body(json.dumps(self.server.state))
+        parts = self.path.split('/')
+        if len(parts) != 6 or parts[1:3] != ['v1', 'statement']:
+            return self.send_body('{}', 404)
+        query_id, page = parts[4], int(parts[5])
+        rule = self.server.queries[query_id]
+        if page == 0 and rule.delay:
+            time.sleep(rule.delay)
+        response = {'id': query_id, 'stats': {'state': 'RUNNING'}}
+        if rule.error:
+            response['error'] = {'message': rule.error, 'errorName': 'GENERIC_INTERNAL_ERROR'}
+            response['stats'] = {'state': 'FAILED'}
+            return self.send_body(json.dumps(response))
+        chunk = rule.rows[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+        if chunk:
+            response['columns'] = [{'name': 'c{0}'.format(i)} for i in range(len(chunk[0]))]
+            response['data'] = chunk
+        if (page + 1) * PAGE_SIZE < len(rule.rows):
+            response['nextUri'] = '{0}/v1/statement/executing/{1}/{2}'.format(
+                self.base(), query_id, page + 1)
+        else:
+            response['stats'] = {'state': 'FINISHED', 'processedRows': len(rule.rows),
+                                 'processedBytes': 8 * len(rule.rows), 'cpuTimeMillis': 1}
+        body = json.dumps(response)
+        self.send_body(body[:len(body) // 2] if rule.truncate else body)
+
+    def do_DELETE(self):
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class MockTrinoServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, rules, gzip=False):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+        self.rules = rules
+        self.gzip = gzip
+        self.gzipped_responses = 0
+        # accepted client sockets, see shutdown_connections
+        self.connections = []
+        self.queries = {}
+        self.state = 'ACTIVE'
+        # time the server was put in the SHUTTING_DOWN state
+        self.shutting_down_since = None
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def rule_for(self, sql):
+        for rule in self.rules:
+            if rule.match in sql:
+                return rule
+        return QueryRule('')
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.connections.append(request)
+        ThreadingMixIn.process_request(self, request, client_address)
+
+    def shutdown_connections(self):
+        """
+        Close every open keep-alive connection from the server side.
+        """
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def set_state(self, state):
+        self.state = state
+        if state == 'SHUTTING_DOWN' and self.shutting_down_since is None:
+            self.shutting_down_since = time.time()
+
+    def new_query(self, rule):
+        with self.lock:
+            query_id = 'q{0}'.format(len(self.queries))
+            self.queries[query_id] = rule
+        return query_id
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'package', 'scripts'))
+
+from benchmark import BenchmarkRunner, format_summary
+from mock_trino_server import MockTrinoServer, QueryRule
+from trino_client import TrinoClient
+
+
+class BenchmarkRunnerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = MockTrinoServer([
+            QueryRule('show catalogs', rows=[['system'], ['tpch']]),
+            # q01
+            QueryRule('sum(quantity) as sum_qty', rows=[[i] for i in range(25)], delay=0.3),
+            # q06
+            QueryRule('sum(extendedprice * discount) as revenue', error='Query exceeded limit'),
+            # q14
+            QueryRule('promo_revenue', garbage=True),
+        ]).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def runner(self, queries, iterations=2):
+        return BenchmarkRunner(lambda: TrinoClient('127.0.0.1', 'root', self.server.port),
+                               warmup_runs=1, iterations=iterations, queries=queries)
+
+    def test_latency_percentiles(self):
+        # q01 is slow, q03 answers at once
+        summaries = self.runner(['q01', 'q03']).run(['tpch', 'tpcds'], ['tiny'], [1])
+        self.assertEqual(1, len(summaries))
+        summary = summaries[0]
+        self.assertEqual(('tpch', 'tiny', 1),
+                         (summary['suite'], summary['scale_factor'], summary['concurrency']))
+        self.assertEqual(4, summary['queries'])
+        self.assertEqual([], summary['failures'])
+        self.assertLess(summary['latency_p50_ms'], 300)
+        self.assertGreaterEqual(summary['latency_p95_ms'], 300)
+        self.assertEqual(2 * 25 + 2 * 1, summary['processed_rows'])
+
+    def test_failures_are_counted_not_raised(self):
+        summary = self.runner(['q03', 'q06', 'q14'], iterations=3).run(['tpch'], ['tiny'],
+                                                                        [2])[0]
+        self.assertEqual(3, summary['queries'])
+        failures = summary['failures']
+        self.assertEqual(6, len(failures))
+        self.assertEqual(['q06'] * 3 + ['q14'] * 3,
+                         sorted(failure['query'] for failure in failures))
+        self.assertTrue(all('Query exceeded limit' in failure['error']
+                            for failure in failures if failure['query'] == 'q06'))
+        self.assertTrue(all(failure['error'].startswith('ValueError')
+                            for failure in failures if failure['query'] == 'q14'))
+        self.assertIn('6 failed', format_summary([summary]))
+
+
+if __name__ == '__main__':
+    unittest.main()
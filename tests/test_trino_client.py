@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import socket
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'package', 'scripts'))
+
+from mock_trino_server import MockTrinoServer, QueryRule
+from trino_client import HTTPConnectionPool, PageDecoder, TrinoClient, drain
+
+# strings that look like the end of a row, the data array or the page
+TRICKY_ROWS = [[i, 'a,]}b' * (i % 3), {'x': '"]},'}, -12345.678e-3] for i in range(25)]
+
+
+def chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class PageDecoderTest(unittest.TestCase):
+    def decode(self, page, chunk_size):
+        decoder = PageDecoder(chunked(json.dumps(page), chunk_size))
+        return list(decoder.rows()), decoder.fields
+
+    def test_one_byte_chunks(self):
+        page = {'id': 'q1', 'columns': [{'name': 'c'}], 'data': TRICKY_ROWS,
+                'nextUri': 'http://x/v1/statement/q1/2', 'stats': {'state': 'RUNNING'}}
+        rows, fields = self.decode(page, 1)
+        self.assertEqual(TRICKY_ROWS, rows)
+        self.assertEqual(dict((key, value) for key, value in page.items() if key != 'data'),
+                         fields)
+
+    def test_numbers_split_across_chunks(self):
+        # a bare number only ends with the character after it
+        page = {'data': [[1234567890123, 0.5e10], [987654321]], 'updateCount': 31415926}
+        text = json.dumps(page)
+        for size in range(1, len(text) + 1):
+            rows, fields = self.decode(page, size)
+            self.assertEqual(page['data'], rows, 'chunk size {0}'.format(size))
+            self.assertEqual({'updateCount': 31415926}, fields, 'chunk size {0}'.format(size))
+
+    def test_empty_data(self):
+        self.assertEqual(([], {'id': 'q', 'stats': {}}),
+                         self.decode({'id': 'q', 'data': [], 'stats': {}}, 3))
+        self.assertEqual(([], {'id': 'q'}), self.decode({'id': 'q'}, 1))
+        self.assertEqual(([], {}), self.decode({}, 1))
+
+    def test_truncated_page(self):
+        text = json.dumps({'data': TRICKY_ROWS, 'stats': {}})
+        decoder = PageDecoder(chunked(text[:len(text) // 2], 7))
+        self.assertRaises(ValueError, list, decoder.rows())
+
+
+class StreamingTest(unittest.TestCase):
+    def setUp(self):
+        self.server = MockTrinoServer([
+            QueryRule('tricky', rows=TRICKY_ROWS),
+            QueryRule('truncated', rows=TRICKY_ROWS, truncate=True),
+        ], gzip=True).start()
+        self.client = TrinoClient('127.0.0.1', 'root', self.server.port)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_gzipped_pages_are_streamed(self):
+        self.assertEqual(TRICKY_ROWS, list(self.client.iter_rows('select tricky')))
+        self.assertGreater(self.server.gzipped_responses, 0)
+
+    def test_gzipped_pages_are_read(self):
+        self.assertTrue(self.client.execute_query('select tricky'))
+        self.assertEqual(TRICKY_ROWS, self.client.get_rows())
+        self.assertGreater(self.server.gzipped_responses, 0)
+
+    def test_truncated_page_raises(self):
+        self.assertRaises(RuntimeError, list, self.client.iter_rows('select truncated'))
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def idle_connection(self, pool):
+        conn = pool.new_connection()
+        conn.sock, server_side = socket.socketpair()
+        pool.put(conn)
+        return conn, server_side
+
+    def test_live_idle_connection_is_reused(self):
+        pool = HTTPConnectionPool('127.0.0.1', 1)
+        conn, server_side = self.idle_connection(pool)
+        self.assertEqual((conn, True), pool.get())
+        server_side.close()
+
+    def test_closed_idle_connection_is_dropped(self):
+        pool = HTTPConnectionPool('127.0.0.1', 1)
+        conn, server_side = self.idle_connection(pool)
+        server_side.close()
+        fresh, reused = pool.get()
+        self.assertFalse(reused)
+        self.assertIsNot(conn, fresh)
+        self.assertIsNone(conn.sock)
+
+    def test_post_after_server_closed_idle_connection(self):
+        server = MockTrinoServer([QueryRule('nation', rows=[[i] for i in range(25)])]).start()
+        client = TrinoClient('127.0.0.1', 'root', server.port)
+        try:
+            self.assertTrue(client.execute_query('select 1'))
+            client.get_rows()
+            # the server drops its keep-alive connections, e.g. on restart
+            server.shutdown_connections()
+            time.sleep(0.1)
+            self.assertTrue(client.execute_query('select * from nation'))
+            self.assertEqual(25, len(client.get_rows()))
+        finally:
+            client.close()
+            server.stop()
+
+
+class DrainTest(unittest.TestCase):
+    def setUp(self):
+        self.server = MockTrinoServer([]).start()
+        self.client = TrinoClient('127.0.0.1', 'root', self.server.port)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def exited_after(self, seconds):
+        since = self.server.shutting_down_since
+        return since is not None and time.time() - since >= seconds
+
+    def test_state_change_with_empty_answer_is_accepted(self):
+        self.assertTrue(self.client.set_server_state('SHUTTING_DOWN'))
+        self.assertEqual('SHUTTING_DOWN', self.client.get_server_json('/v1/info/state'))
+
+    def test_drain_waits_for_the_server_to_exit(self):
+        started = time.time()
+        self.assertTrue(drain(self.client, lambda: self.exited_after(0.3), 10))
+        self.assertGreaterEqual(time.time() - started, 0.3)
+        self.assertEqual('SHUTTING_DOWN', self.server.state)
+
+    def test_drain_gives_up_after_timeout(self):
+        self.assertFalse(drain(self.client, lambda: False, 0.5))
+
+    def test_drain_fails_when_the_server_is_not_reachable(self):
+        self.server.stop()
+        self.assertFalse(drain(self.client, lambda: True, 10))
+
+
+if __name__ == '__main__':
+    unittest.main()